@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class PostsConfig(AppConfig):
     name = 'posts'
     verbose_name = 'Публикации'
+
+    def ready(self):
+        from posts import signals  # noqa: F401
+        post_migrate.connect(install_search, sender=self)
+
+
+def install_search(sender, using, **kwargs):
+    # Индекс FTS5 не описывается моделью, поэтому создается после
+    # миграций приложения
+    from posts import search
+    search.install(using)
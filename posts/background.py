@@ -0,0 +1,49 @@
+"""Фоновые задачи в пулах потоков процесса.
+
+Миниатюры, доставка постов в ленты, пересчет счетчиков и обновление
+устаревших копий страниц выполняются после ответа, каждый в своем пуле:
+медленная задача одного вида не задерживает остальные. Пул создается при
+первой задаче. Ошибка задачи записывается в журнал, а соединения с базой
+закрываются после каждой задачи, как после запроса.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+def run(task, *args):
+    try:
+        task(*args)
+    except Exception:
+        logger.exception('Фоновая задача не выполнена: %r%r', task, args)
+    finally:
+        close_old_connections()
+
+
+class Pool:
+    """Пул потоков ``name``; ``workers`` — число потоков или имя
+    настройки с ним."""
+
+    def __init__(self, name, workers=1):
+        self.name = name
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                workers = self.workers
+                if isinstance(workers, str):
+                    workers = getattr(settings, workers)
+                self._executor = ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix=self.name)
+            return self._executor
+
+    def submit(self, task, *args):
+        self.executor().submit(run, task, *args)
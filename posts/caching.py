@@ -0,0 +1,140 @@
+"""Версии закешированных фрагментов.
+
+Вместо поиска и удаления ключей кеша каждый фрагмент хранится под ключом,
+в который входят номера версий связанных объектов. При изменении объекта
+его версия увеличивается, и старые записи просто перестают читаться, а
+затем вытесняются из кеша.
+
+Ленты кешируются через ``remember``: версия хранится внутри записи, а не в
+ключе, поэтому после сброса версии или истечения срока устаревшая запись
+остается под рукой, пока один процесс строит новую.
+"""
+import hashlib
+import math
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from posts import metrics
+
+
+def version_key(name):
+    return 'version:%s' % name
+
+
+def new_version():
+    # Версия, созданная после вытеснения счетчика из кеша, не должна
+    # совпасть ни с одной из прежних
+    return int(time.time() * 1000)
+
+
+def get_versions(*names):
+    """Текущие версии по именам за одно обращение к кешу."""
+    keys = {version_key(name): name for name in names}
+    found = cache.get_many(keys)
+    versions = {}
+    for key, name in keys.items():
+        if key not in found:
+            version = new_version()
+            cache.add(key, version, None)
+            found[key] = cache.get(key, version)
+        versions[name] = found[key]
+    return versions
+
+
+def bump(*names):
+    for name in names:
+        try:
+            cache.incr(version_key(name))
+        except ValueError:
+            cache.add(version_key(name), new_version(), None)
+
+
+def page_etag(request, *names):
+    """ETag страницы по версиям ``names``, адресу и пользователю.
+
+    Версии читаются из кеша одним запросом, поэтому совпавший
+    ``If-None-Match`` получает 304 без запросов к ленте и рендеринга.
+    Пользователь входит в ETag: навигация и кнопки зависят от него.
+    """
+    versions = get_versions(*names)
+    parts = [request.get_full_path(), str(request.user.pk or 0)]
+    parts.extend('%s=%s' % (name, versions[name]) for name in names)
+    return hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+
+def page_versions(username=None, slug=None):
+    """Версии страниц, на которых виден пост автора ``username`` из группы
+    ``slug``: главной, профиля и группы."""
+    names = ['index']
+    if username:
+        names.append('profile:%s' % username)
+    if slug:
+        names.append('group-page:%s' % slug)
+    return names
+
+
+def bump_post_pages(post_id):
+    """Сбросить страницы, на которых виден пост ``post_id``."""
+    from posts.models import Post
+    row = (Post.objects.filter(pk=post_id)
+           .values_list('author__username', 'group__slug').first())
+    if row is not None:
+        bump(*page_versions(*row))
+
+
+def should_refresh(expires, delta, beta=1.0):
+    """Пора ли обновить запись заранее.
+
+    Вероятность растет к концу срока и тем быстрее, чем дольше запись
+    строится (XFetch), поэтому обновления распределяются во времени, а не
+    совпадают в момент истечения.
+    """
+    return time.time() - delta * beta * math.log(random.random()) >= expires
+
+
+def remember(key, compute, timeout, version=None, cacheable=None,
+             name=None):
+    """Значение ``compute()`` из кеша; строит его только один процесс.
+
+    Запись свежая, пока не истек ``timeout`` и ее версия равна
+    ``version``. Устаревшую запись перестраивает тот, кто первым возьмет
+    блокировку, а остальные тем временем получают прежнее значение и не
+    ждут. Если значения нет совсем, остальные строят его сами, не сохраняя.
+    Значения, для которых ``cacheable`` возвращает ложь, не сохраняются.
+
+    ``name`` — имя кеша в метриках, по умолчанию начало ключа до
+    двоеточия. Прежнее значение считается попаданием.
+    """
+    name = name or key.split(':', 1)[0]
+    entry = cache.get(key)
+    if entry is not None:
+        entry_version, value, expires, delta = entry
+        if (entry_version == version
+                and not should_refresh(expires, delta)):
+            metrics.record_cache(name, hits=1)
+            return value
+    lock = 'lock:%s' % key
+    if not cache.add(lock, 1, settings.CACHE_LOCK_TIMEOUT):
+        if entry is not None:
+            metrics.record_cache(name, hits=1)
+            return value
+        # Отдать нечего: ожидание задержало бы запрос на все время
+        # построения
+        metrics.record_cache(name, misses=1)
+        return compute()
+    metrics.record_cache(name, misses=1)
+    try:
+        start = time.time()
+        value = compute()
+        delta = time.time() - start
+        if cacheable is None or cacheable(value):
+            # Запись живет дольше срока свежести: устаревшее значение
+            # отдается, пока строится новое
+            cache.set(key, (version, value, time.time() + timeout, delta),
+                      timeout + settings.CACHE_STALE_TIMEOUT)
+        return value
+    finally:
+        cache.delete(lock)
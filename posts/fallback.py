@@ -0,0 +1,191 @@
+"""Устаревшая копия ленты вместо ошибки (stale-if-error).
+
+Когда SQLite заблокирована долгой записью или запрос ленты не укладывается
+в ``FEED_LATENCY_BUDGET``, страница строится из последней удачной копии,
+а не отдается ошибкой 500. Копия помечается заголовком ``Warning: 110`` и
+не кешируется прокси, а страница перестраивается в фоне с повторами
+(stale-while-revalidate). Пока фоновое построение идет, копия отдается
+сразу, без запросов к базе: во время сбоя запрос не ждет бюджет заново.
+
+Копии пишутся только из страниц гостей, одинаковых для всех, и хранятся в
+отдельном кеше ``stale``; при ошибке копию получают и вошедшие
+пользователи. Ключ — имя представления, его аргументы и позиция страницы,
+а не весь адрес, поэтому лишние параметры запроса не плодят копий. Копия
+перезаписывается не чаще раза в ``STALE_COPY_INTERVAL`` секунд.
+
+Бюджет времени соблюдается только на SQLite: обработчик прогресса
+прерывает запрос, который идет дольше бюджета. Если копии нет, прерванная
+страница строится заново без ограничения.
+"""
+import hashlib
+import logging
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.http import HttpRequest, QueryDict
+from django.utils.cache import patch_cache_control
+
+from posts.background import Pool
+from posts.paginator import position_key
+
+logger = logging.getLogger(__name__)
+
+STALE_WARNING = '110 - "Response is Stale"'
+# Сколько инструкций SQLite выполняет между проверками бюджета
+PROGRESS_STEP = 1000
+# Параметры запроса, которые читают страницы с копиями
+PAGE_PARAMS = ('page', 'cursor')
+
+pool = Pool('stale-refresh', 'STALE_REFRESH_WORKERS')
+
+
+class LatencyBudget:
+    """Прервать запросы к базе, которые выходят за ``seconds`` с начала
+    блока."""
+
+    def __init__(self, seconds, using=DEFAULT_DB_ALIAS):
+        self.seconds = seconds
+        self.connection = connections[using]
+        self.exceeded = False
+
+    def __enter__(self):
+        if not self.seconds or self.connection.vendor != 'sqlite':
+            self.connection = None
+            return self
+        self.connection.ensure_connection()
+        deadline = time.monotonic() + self.seconds
+
+        def check():
+            # Ненулевой ответ прерывает запрос с OperationalError
+            if time.monotonic() > deadline:
+                self.exceeded = True
+            return self.exceeded
+
+        self.connection.connection.set_progress_handler(check, PROGRESS_STEP)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.connection is not None and self.connection.connection:
+            self.connection.connection.set_progress_handler(None, 0)
+
+
+def copies():
+    return caches['stale']
+
+
+def copy_key(view, request, kwargs):
+    arguments = '&'.join('%s=%s' % item for item in sorted(kwargs.items()))
+    return 'stale-copy:%s:%s:%s' % (
+        view.__name__, hashlib.md5(arguments.encode()).hexdigest(),
+        position_key(*(request.GET.get(name) for name in PAGE_PARAMS)))
+
+
+def keep(key, response, force=False):
+    """Сохранить удачный ответ как копию на случай ошибки, если прежняя
+    копия старше ``STALE_COPY_INTERVAL`` или ``force``."""
+    marker = 'stale-kept:%s' % key
+    if force:
+        copies().set(marker, 1, settings.STALE_COPY_INTERVAL)
+    elif not copies().add(marker, 1, settings.STALE_COPY_INTERVAL):
+        return
+    copies().set(key, response, settings.CACHE_STALE_TIMEOUT)
+
+
+def guest_request(request):
+    """Новый запрос гостя к той же странице для фонового построения.
+
+    Живой запрос в другой поток не передается: у него сессия, пользователь
+    и заголовки условного GET, а страница строится для всех.
+    """
+    fresh = HttpRequest()
+    fresh.method = 'GET'
+    fresh.path = request.path
+    fresh.path_info = request.path_info
+    fresh.META = {
+        'SERVER_NAME': request.META.get('SERVER_NAME', ''),
+        'SERVER_PORT': request.META.get('SERVER_PORT', ''),
+        'HTTP_HOST': request.get_host(),
+    }
+    fresh.GET = QueryDict(mutable=True)
+    for name in PAGE_PARAMS:
+        if name in request.GET:
+            fresh.GET[name] = request.GET[name]
+    fresh.resolver_match = request.resolver_match
+    fresh.user = AnonymousUser()
+    return fresh
+
+
+def refresh(view, request, args, kwargs, key):
+    """Перестроить страницу после ошибки, повторяя с растущей паузой."""
+    try:
+        for attempt in range(settings.STALE_REFRESH_ATTEMPTS):
+            if attempt:
+                time.sleep(settings.STALE_REFRESH_DELAY * 2 ** (attempt - 1))
+            try:
+                response = view(request, *args, **kwargs)
+            except DatabaseError:
+                logger.warning('Не удалось обновить %s, попытка %s',
+                               request.path, attempt + 1, exc_info=True)
+                continue
+            if response.status_code == 200:
+                keep(key, response, force=True)
+            return
+    finally:
+        copies().delete('stale-refresh:%s' % key)
+
+
+def schedule_refresh(view, request, args, kwargs, key):
+    """Запустить одно фоновое построение на ключ копии."""
+    if copies().add('stale-refresh:%s' % key, 1,
+                    settings.STALE_REFRESH_TIMEOUT):
+        pool.submit(refresh, view, guest_request(request), args, kwargs,
+                    key)
+
+
+def serve(stale):
+    stale['Warning'] = STALE_WARNING
+    patch_cache_control(stale, no_cache=True)
+    return stale
+
+
+def stale_if_error(view):
+    """Отдавать последнюю удачную копию страницы, если ее запросы к базе
+    падают или не укладываются в ``FEED_LATENCY_BUDGET``.
+
+    Декоратор ставится над ``condition``: у копии остается ETag, с которым
+    она была построена.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = copy_key(view, request, kwargs)
+        if copies().get('stale-refresh:%s' % key) is not None:
+            # Страница перестраивается после ошибки: база, скорее всего,
+            # еще недоступна
+            stale = copies().get(key)
+            if stale is not None:
+                return serve(stale)
+        budget = LatencyBudget(settings.FEED_LATENCY_BUDGET)
+        try:
+            with budget:
+                response = view(request, *args, **kwargs)
+        except DatabaseError:
+            stale = copies().get(key)
+            if stale is None:
+                if not budget.exceeded:
+                    raise
+                # Медленная страница без копии лучше ошибки
+                response = view(request, *args, **kwargs)
+            else:
+                logger.warning('Отдана устаревшая копия %s', request.path,
+                               exc_info=True)
+                schedule_refresh(view, request, args, kwargs, key)
+                return serve(stale)
+        if (response.status_code == 200 and not response.cookies
+                and not request.user.is_authenticated):
+            keep(key, response)
+        return response
+    return wrapper
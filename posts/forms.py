@@ -1,5 +1,7 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 from django.utils.translation import gettext_lazy as _
+from .images import normalize
 from .models import Post, Comment
 
 
@@ -15,6 +17,19 @@ class PostForm(forms.ModelForm):
             'text': _('В верхнее поле можно написать текст')
         }
 
+    def clean_image(self):
+        image = self.cleaned_data['image']
+        # Уже сохраненную картинку при редактировании не трогаем
+        if not isinstance(image, UploadedFile):
+            return image
+        normalized = normalize(image)
+        if normalized is not image:
+            image.close()
+            # Временный файл закроется и удалится вместе с запросом, как
+            # и исходная загрузка
+            self.files[self.add_prefix('image')] = normalized
+        return normalized
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,96 @@
+"""Обработка картинок постов при загрузке.
+
+Картинка сохраняется уже уменьшенной до ``IMAGE_MAX_SIDE`` по большей
+стороне, повернутой по EXIF и пересжатой без метаданных, поэтому
+миниатюрам не приходится каждый раз декодировать многомегабайтный снимок с
+камеры. Размер в пикселях проверяется по заголовку до декодирования, так
+что сжатая «бомба» отклоняется, не занимая память.
+
+Результат пишется во временный файл, а не в память.
+"""
+import os
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from PIL import Image, ImageOps
+
+# Форматы, которые сохраняются как есть; остальные переводятся в JPEG
+KEEP_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+SAVE_OPTIONS = {
+    'JPEG': {'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True},
+    'GIF': {'optimize': True},
+    'WEBP': {'method': 6},
+}
+
+
+def check_pixels(image):
+    if image.width * image.height > settings.IMAGE_MAX_PIXELS:
+        raise ValidationError(
+            'Картинка слишком большая: %(width)s×%(height)s пикселей',
+            code='image_too_large',
+            params={'width': image.width, 'height': image.height})
+
+
+def normalize(upload):
+    """Уменьшенная и очищенная от метаданных копия загруженной картинки.
+
+    Анимации не пересжимаются, если помещаются в допустимый размер, и
+    отклоняются, если не помещаются: первый кадр вместо анимации был бы
+    неожиданной потерей. Поврежденный файл отклоняется: проверка
+    ``ImageField`` не декодирует JPEG, и обрезанный снимок доходит сюда.
+    """
+    try:
+        return convert(upload)
+    except Image.DecompressionBombError:
+        raise ValidationError('Картинка слишком большая',
+                              code='image_too_large')
+    except (OSError, SyntaxError):
+        raise ValidationError('Файл картинки поврежден',
+                              code='invalid_image')
+
+
+def convert(upload):
+    upload.seek(0)
+    image = Image.open(upload)
+    check_pixels(image)
+    max_side = settings.IMAGE_MAX_SIDE
+    if getattr(image, 'is_animated', False):
+        if max(image.size) > max_side:
+            raise ValidationError(
+                'Анимация должна быть не больше %(side)s пикселей '
+                'по большей стороне',
+                code='image_too_large', params={'side': max_side})
+        upload.seek(0)
+        return upload
+
+    output_format = image.format if image.format in KEEP_FORMATS else 'JPEG'
+    icc_profile = image.info.get('icc_profile')
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    if output_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    options = dict(SAVE_OPTIONS[output_format])
+    if output_format in ('JPEG', 'WEBP'):
+        options['quality'] = settings.IMAGE_QUALITY
+    if icc_profile:
+        # Цветовой профиль не метаданные: без него искажаются цвета
+        options['icc_profile'] = icc_profile
+    if output_format == 'GIF' and 'transparency' in image.info:
+        options['transparency'] = image.info['transparency']
+
+    name = '%s.%s' % (os.path.splitext(os.path.basename(upload.name))[0],
+                      KEEP_FORMATS[output_format])
+    result = TemporaryUploadedFile(
+        name, Image.MIME[output_format], 0, None)
+    try:
+        image.save(result, output_format, **options)
+    except Exception:
+        result.close()
+        raise
+    result.size = result.tell()
+    result.seek(0)
+    return result
@@ -0,0 +1,106 @@
+"""Хранилище ключей sorl-thumbnail с пакетной подгрузкой.
+
+Стандартный ``cached_db`` KVStore ищет каждую миниатюру отдельно, и
+страница из десяти постов стоит десяти обращений к кешу, а при промахах
+еще и к базе. Здесь записи всех миниатюр страницы подгружаются одним
+``get_many`` из кеша и одним запросом ``key__in`` к базе до рендеринга, а
+найденные значения хранятся в LRU внутри процесса.
+
+В LRU попадают только найденные записи: отсутствие миниатюры быстро
+устаревает, когда ее создает фоновый поток или другой процесс.
+"""
+import threading
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE, KVStore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+
+class PrefetchingKVStore(KVStore):
+    def __init__(self):
+        super().__init__()
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = Counter()
+
+    def stats(self):
+        """Счетчики попаданий и промахов LRU и подгруженных записей."""
+        with self._lock:
+            return {name: self._counters[name]
+                    for name in ('hits', 'misses', 'prefetched')}
+
+    def reset(self):
+        """Очистить LRU процесса и счетчики."""
+        with self._lock:
+            self._local.clear()
+            self._counters.clear()
+
+    def _lookup(self, key):
+        with self._lock:
+            if key in self._local:
+                self._local.move_to_end(key)
+                self._counters['hits'] += 1
+                return self._local[key]
+            self._counters['misses'] += 1
+        return None
+
+    def _remember(self, values):
+        with self._lock:
+            for key, value in values.items():
+                self._local[key] = value
+                self._local.move_to_end(key)
+            while len(self._local) > settings.THUMBNAIL_LRU_SIZE:
+                self._local.popitem(last=False)
+
+    def _forget(self, keys):
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
+
+    def prefetch(self, keys):
+        """Подгрузить в LRU записи ``keys`` одним запросом к кешу и одним
+        к базе.
+
+        Ключи полные, с префиксом sorl. Отсутствующие в базе ключи
+        отмечаются в кеше пустым значением, как это делает ``_get_raw``.
+        """
+        with self._lock:
+            keys = [key for key in set(keys) if key not in self._local]
+        if not keys:
+            return
+        found = self.cache.get_many(keys)
+        missing = [key for key in keys if key not in found]
+        if missing:
+            stored = dict(KVStoreModel.objects.filter(key__in=missing)
+                          .values_list('key', 'value'))
+            self.cache.set_many(
+                {key: stored.get(key, EMPTY_VALUE) for key in missing},
+                sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+            found.update(stored)
+        found = {key: value for key, value in found.items()
+                 if value != EMPTY_VALUE}
+        self._remember(found)
+        with self._lock:
+            self._counters['prefetched'] += len(found)
+
+    def _get_raw(self, key):
+        value = self._lookup(key)
+        if value is None:
+            value = super()._get_raw(key)
+            if value is not None:
+                self._remember({key: value})
+        return value
+
+    def _set_raw(self, key, value):
+        super()._set_raw(key, value)
+        self._remember({key: value})
+
+    def _delete_raw(self, *keys):
+        super()._delete_raw(*keys)
+        self._forget(keys)
+
+    def clear(self, delete_thumbnails=False):
+        super().clear(delete_thumbnails)
+        self.reset()
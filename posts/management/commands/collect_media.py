@@ -0,0 +1,137 @@
+import os
+import posixpath
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from sorl.thumbnail import default, delete
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore
+
+from posts.models import Post
+from posts.utils import batches
+
+
+def walk(storage, directory):
+    """Файлы каталога хранилища вместе с результатом ``stat``.
+
+    Каталоги читаются потоком через ``os.scandir``, без списка всех файлов.
+    """
+    try:
+        entries = os.scandir(storage.path(directory))
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            name = posixpath.join(directory, entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk(storage, name)
+            elif entry.is_file(follow_symlinks=False):
+                yield name, entry.stat(follow_symlinks=False)
+
+
+def thumbnails_size(source):
+    """Суммарный размер миниатюр, записанных в KVStore для картинки."""
+    size = 0
+    for key in default.kvstore._get(source.key, identity='thumbnails') or ():
+        thumbnail = default.kvstore._get(key)
+        if thumbnail is None:
+            continue
+        try:
+            size += thumbnail.storage.size(thumbnail.name)
+        except OSError:
+            pass
+    return size
+
+
+class Command(BaseCommand):
+    help = ('Удаляет картинки, на которые не ссылается ни один пост, '
+            'и миниатюры без записи в KVStore')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, сколько места освободится')
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.MEDIA_BATCH_SIZE,
+            help='Сколько файлов проверять одним запросом')
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.size = options['batch_size']
+        # Недавние файлы могут принадлежать еще не сохраненному посту
+        self.cutoff = time.time() - settings.MEDIA_RELEASE_GRACE
+        images, images_size = self.collect_images()
+        thumbs, thumbs_size = self.collect_thumbnails()
+        self.stdout.write('Картинок без ссылок: {} ({} байт)'.format(
+            images, images_size))
+        self.stdout.write('Миниатюр без записей: {} ({} байт)'.format(
+            thumbs, thumbs_size))
+        self.stdout.write('{}: {} байт'.format(
+            'Можно освободить' if self.dry_run else 'Освобождено',
+            images_size + thumbs_size))
+
+    def old_files(self, storage, directory):
+        return ((name, stat) for name, stat in walk(storage, directory)
+                if stat.st_mtime < self.cutoff)
+
+    def collect_images(self):
+        """Картинки постов: файлы каталога ``upload_to`` проверяются по
+        столбцу ``Post.image`` пачками, одним запросом на пачку."""
+        field = Post.image.field
+        storage = field.storage
+        count = total = 0
+        files = self.old_files(storage, field.upload_to.rstrip('/'))
+        for batch in batches(files, self.size):
+            referenced = set(Post.objects.filter(
+                image__in=[name for name, _ in batch])
+                .values_list('image', flat=True))
+            for name, stat in batch:
+                if name in referenced:
+                    continue
+                source = ImageFile(name, storage)
+                size = stat.st_size + thumbnails_size(source)
+                if not self.dry_run:
+                    if not self.unreferenced(storage, name):
+                        continue
+                    # Вместе с файлом удаляются его миниатюры и записи
+                    delete(source)
+                count += 1
+                total += size
+        return count, total
+
+    def unreferenced(self, storage, name):
+        """Проверить картинку еще раз прямо перед удалением.
+
+        После проверки пачки тот же файл могли загрузить заново и сохранить
+        с ним пост: загрузка обновляет время изменения файла.
+        """
+        try:
+            stat = os.stat(storage.path(name))
+        except FileNotFoundError:
+            return False
+        return (stat.st_mtime < self.cutoff
+                and not Post.objects.filter(image=name).exists())
+
+    def collect_thumbnails(self):
+        """Миниатюры, о которых не знает KVStore: их не покажет ни один
+        шаблон."""
+        storage = default.storage
+        count = total = 0
+        files = self.old_files(storage,
+                               sorl_settings.THUMBNAIL_PREFIX.rstrip('/'))
+        for batch in batches(files, self.size):
+            keys = {add_prefix(ImageFile(name, storage).key): (name, stat)
+                    for name, stat in batch}
+            known = set(KVStore.objects.filter(key__in=keys)
+                        .values_list('key', flat=True))
+            for key, (name, stat) in keys.items():
+                if key in known:
+                    continue
+                count += 1
+                total += stat.st_size
+                if not self.dry_run:
+                    storage.delete(name)
+        return count, total
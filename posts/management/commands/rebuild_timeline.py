@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from posts import timeline
+from posts.models import Follow, Timeline
+
+
+class Command(BaseCommand):
+    help = 'Заново заполняет материализованные ленты подписок'
+
+    def handle(self, *args, **options):
+        Timeline.objects.all().delete()
+        follows = Follow.objects.values_list('user_id', 'author_id')
+        for user_id, author_id in follows.iterator():
+            timeline.backfill(user_id, author_id)
+        self.stdout.write('Ленты заполнены: {} записей'.format(
+            Timeline.objects.count()))
@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from posts.models import Follow, Group, GroupStats, Post, UserStats
+from posts.utils import batches
+
+User = get_user_model()
+
+FIELDS = ('posts_count', 'followers_count', 'following_count')
+GROUP_FIELDS = ('posts_count',)
+
+
+def counter(queryset, field):
+    total = (queryset.filter(**{field: OuterRef('pk')}).order_by()
+             .values(field).annotate(total=Count('pk')).values('total'))
+    return Coalesce(Subquery(total, output_field=IntegerField()), 0)
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики профилей и исправляет расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.STATS_BATCH_SIZE,
+            help='Сколько счетчиков сверять одним запросом')
+
+    def handle(self, *args, **options):
+        self.size = options['batch_size']
+        users = User.objects.order_by('pk').annotate(
+            posts_count=counter(Post.objects, 'author'),
+            followers_count=counter(Follow.objects, 'author'),
+            following_count=counter(Follow.objects, 'user'),
+        ).values_list('pk', *FIELDS)
+        groups = Group.objects.order_by('pk').annotate(
+            posts_count=counter(Post.objects, 'group'),
+        ).values_list('pk', *GROUP_FIELDS)
+        repaired = (self.repair(users, UserStats, 'user_id', FIELDS)
+                    + self.repair(groups, GroupStats, 'group_id',
+                                  GROUP_FIELDS))
+        self.stdout.write('Исправлено счетчиков: {}'.format(repaired))
+
+    def repair(self, rows, model, key, fields):
+        """Сверить счетчики ``model`` с посчитанными в ``rows`` и
+        исправить расхождения пачками."""
+        repaired = 0
+        for batch in batches(rows.iterator(chunk_size=self.size),
+                             self.size):
+            stored = model.objects.in_bulk([row[0] for row in batch])
+            created, changed = [], []
+            for pk, *counts in batch:
+                actual = dict(zip(fields, counts))
+                stats = stored.get(pk)
+                if stats is None:
+                    created.append(model(**{key: pk}, **actual))
+                elif any(getattr(stats, f) != v for f, v in actual.items()):
+                    for field, value in actual.items():
+                        setattr(stats, field, value)
+                    changed.append(stats)
+            model.objects.bulk_create(created, ignore_conflicts=True)
+            model.objects.bulk_update(changed, fields)
+            repaired += len(created) + len(changed)
+        return repaired
@@ -0,0 +1,34 @@
+"""Удаление картинок постов, на которые больше нет ссылок.
+
+Одна картинка может принадлежать нескольким постам (см.
+``posts.storage``), поэтому файл удаляется только вместе с последним
+постом, который на него ссылается. Файл, измененный недавно, не
+удаляется: его могла повторно загрузить еще не сохраненная форма.
+Такие файлы убирает сборщик мусора.
+"""
+import os
+import time
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from sorl.thumbnail import delete
+from sorl.thumbnail.images import ImageFile
+
+from posts.models import Post
+
+storage = Post.image.field.storage
+
+
+def release(name):
+    """Удалить картинку и ее миниатюры, если на нее не ссылается ни один
+    пост."""
+    if not name or Post.objects.filter(image=name).exists():
+        return
+    try:
+        modified = os.path.getmtime(storage.path(name))
+    except (FileNotFoundError, SuspiciousFileOperation):
+        # Файла нет или путь ведет за пределы MEDIA_ROOT: удалять нечего
+        return
+    if time.time() - modified < settings.MEDIA_RELEASE_GRACE:
+        return
+    delete(ImageFile(name, storage))
@@ -0,0 +1,260 @@
+"""Метрики производительности запросов в формате Prometheus.
+
+``posts.middleware.MetricsMiddleware`` замеряет для каждого запроса время
+ответа, число и время SQL-запросов, время рендеринга шаблонов и попадания
+в кеши, а гистограммы и счетчики копятся в процессе по имени URL. Их
+отдает ``/metrics`` в текстовом формате Prometheus.
+
+Каждый поток пишет в свою часть реестра, поэтому замер не берет
+блокировок: блокировка нужна только при первом запросе потока. Чтение
+складывает части всех потоков, а части завершившихся потоков при этом
+переносит в общую, чтобы реестр не рос вместе с числом потоков.
+
+Время шаблонов считает бэкенд ``DjangoTemplates`` из этого модуля: он
+указывается в ``TEMPLATES`` вместо стандартного. Вложенный рендеринг,
+например карточек внутри страницы, входит во время внешнего шаблона, как и
+запросы, которые шаблон выполняет.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from django.template.backends import django as django_backend
+from django.urls import Resolver404, resolve
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+HISTOGRAMS = {
+    'yatube_request_duration_seconds': (
+        'Время ответа в секундах', TIME_BUCKETS),
+    'yatube_db_queries': (
+        'Число SQL-запросов за запрос', COUNT_BUCKETS),
+    'yatube_db_duration_seconds': (
+        'Время SQL-запросов за запрос в секундах', TIME_BUCKETS),
+    'yatube_template_duration_seconds': (
+        'Время рендеринга шаблонов за запрос в секундах',
+        TIME_BUCKETS),
+}
+CACHE_COUNTER = 'yatube_cache_requests_total'
+CACHE_HELP = 'Обращения к кешам по результату: hit или miss'
+
+_current = threading.local()
+
+
+def add(totals, key, value):
+    if isinstance(value, list):
+        total = totals.setdefault(key, [0] * len(value))
+        for index, item in enumerate(value):
+            total[index] += item
+    else:
+        totals[key] = totals.get(key, 0) + value
+
+
+class Registry:
+    """Гистограммы и счетчики, разбитые по потокам."""
+
+    def __init__(self):
+        self._local = threading.local()
+        # Части живых потоков: (поток, часть)
+        self._shards = []
+        # Сумма частей завершившихся потоков
+        self._base = {}
+        self._lock = threading.Lock()
+
+    def shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def observe(self, name, labels, value):
+        shard = self.shard()
+        key = (name, labels)
+        try:
+            entry = shard[key]
+        except KeyError:
+            # Счетчики корзин, затем сумма и число наблюдений
+            entry = shard[key] = [0] * (len(HISTOGRAMS[name][1]) + 3)
+        entry[bisect_left(HISTOGRAMS[name][1], value)] += 1
+        entry[-2] += value
+        entry[-1] += 1
+
+    def increment(self, name, labels, amount=1):
+        shard = self.shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def collect(self):
+        """Сумма частей всех потоков: {(имя, метки): значение}."""
+        with self._lock:
+            alive = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                else:
+                    # В часть завершившегося потока больше никто не пишет
+                    for key, value in shard.items():
+                        add(self._base, key, value)
+            self._shards = alive
+            totals = {}
+            for key, value in self._base.items():
+                add(totals, key, value)
+            for thread, shard in alive:
+                # copy() словаря атомарна, в отличие от обхода
+                for key, value in shard.copy().items():
+                    add(totals, key, value)
+        return totals
+
+    def clear(self):
+        with self._lock:
+            self._base.clear()
+            for thread, shard in self._shards:
+                shard.clear()
+
+
+registry = Registry()
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.cache = {}
+
+
+def current():
+    """Замеры текущего запроса или None вне ``MetricsMiddleware``
+    (например, в фоновых потоках)."""
+    return getattr(_current, 'stats', None)
+
+
+def record_cache(name, hits=0, misses=0):
+    """Учесть обращения к кешу ``name`` в текущем запросе."""
+    stats = current()
+    if stats is None:
+        return
+    counts = stats.cache.setdefault(name, [0, 0])
+    counts[0] += hits
+    counts[1] += misses
+
+
+def escape(value):
+    return (str(value).replace('\\', '\\\\').replace('\n', '\\n')
+            .replace('"', '\\"'))
+
+
+def format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    return '{%s}' % ','.join('%s="%s"' % (name, escape(value))
+                             for name, value in pairs)
+
+
+def format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """Метрики реестра в текстовом формате Prometheus."""
+    totals = registry.collect()
+    lines = []
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s histogram' % name)
+        for (metric, labels), entry in sorted(totals.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + (float('inf'),), entry):
+                cumulative += count
+                lines.append('%s_bucket%s %s' % (
+                    name, format_labels(labels, le=format_number(bound)),
+                    cumulative))
+            lines.append('%s_sum%s %s' % (name, format_labels(labels),
+                                          format_number(entry[-2])))
+            lines.append('%s_count%s %s' % (name, format_labels(labels),
+                                            entry[-1]))
+    lines.append('# HELP %s %s' % (CACHE_COUNTER, CACHE_HELP))
+    lines.append('# TYPE %s counter' % CACHE_COUNTER)
+    for (metric, labels), value in sorted(totals.items()):
+        if metric == CACHE_COUNTER:
+            lines.append('%s%s %s' % (CACHE_COUNTER, format_labels(labels),
+                                      value))
+    return '\n'.join(lines) + '\n'
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        # Ответ из кеша страниц отдается до разбора адреса
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return '<unresolved>'
+    return match.view_name
+
+
+def start_request():
+    _current.stats = RequestStats()
+    return _current.stats
+
+
+def finish_request(request, stats, duration):
+    """Добавить замеры запроса в реестр."""
+    _current.stats = None
+    labels = (('view', view_name(request)),)
+    registry.observe('yatube_request_duration_seconds', labels, duration)
+    registry.observe('yatube_db_queries', labels, stats.queries)
+    registry.observe('yatube_db_duration_seconds', labels, stats.db_time)
+    registry.observe('yatube_template_duration_seconds', labels,
+                     stats.template_time)
+    for name, (hits, misses) in stats.cache.items():
+        for result, amount in (('hit', hits), ('miss', misses)):
+            if amount:
+                registry.increment(
+                    CACHE_COUNTER,
+                    labels + (('cache', name), ('result', result)), amount)
+
+
+def count_query(execute, sql, params, many, context):
+    stats = current()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - start
+
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        stats = current()
+        if stats is None:
+            return super().render(context, request)
+        stats.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_depth -= 1
+            if not stats.template_depth:
+                stats.template_time += time.perf_counter() - start
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """Стандартный бэкенд, который замеряет время рендеринга."""
+
+    def from_string(self, template_code):
+        return Template(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name).template, self)
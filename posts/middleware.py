@@ -0,0 +1,135 @@
+"""Кеш целых страниц для анонимных посетителей.
+
+Главная, страницы групп и профили для посетителя без сессии одинаковы,
+поэтому готовый ответ хранится в кеше под ключом из пути, номера
+страницы или курсора и версий страницы, а запрос не проходит через
+сессии, аутентификацию, CSRF и шаблоны. Прочие параметры запроса в ключ
+не входят. Версии меняют сигналы при изменении постов, комментариев,
+групп и подписок, которые видны на странице (см. ``page_versions``).
+
+Ответы кешируются, только если они не ставят cookie. ``Vary: Cookie``
+из них убирается, чтобы ответ могли хранить и прокси; запросы с cookie
+сессии прокси должен пропускать мимо кеша, как это и делает эта
+прослойка. Браузер же проверяет страницу при каждом показе
+(``max-age=0``): иначе после входа он показал бы из своего кеша страницу
+гостя. Одновременные промахи строят страницу один раз, остальные
+запросы тем временем получают прежнюю версию (см. ``remember``).
+"""
+import hashlib
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.urls import Resolver404, resolve
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+
+from posts import metrics
+from posts.caching import get_versions, remember
+from posts.paginator import position_key
+
+# Версии страницы и параметры запроса, которые она читает
+PAGES = {
+    'posts:index': (lambda kwargs: ['index'], ('page', 'cursor')),
+    'posts:group': (lambda kwargs: ['group-page:%s' % kwargs['slug']],
+                    ('page',)),
+    'posts:profile': (lambda kwargs: ['profile:%s' % kwargs['username']],
+                      ('page',)),
+}
+
+
+def page_key(request, params):
+    """Ключ страницы из пути и параметров ``params``. Остальные параметры
+    страница не читает, и они не должны плодить копии в кеше."""
+    return 'page:%s:%s' % (
+        hashlib.md5(request.path.encode()).hexdigest(),
+        position_key(*(request.GET.get(name) for name in params)))
+
+
+class AnonymousPageCacheMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        page = self.page(request)
+        if page is None:
+            return self.get_response(request)
+        names, params = page
+        # names — имена пользователей и групп, видные на любой странице
+        names.append('names')
+        versions = get_versions(*names)
+        key = page_key(request, params)
+        built = []
+
+        def build():
+            response = self.get_response(request)
+            built.append(response)
+            if self.cacheable(response):
+                self.make_public(response)
+            return response
+
+        response = remember(
+            key, build, settings.PAGE_CACHE_TIMEOUT,
+            '.'.join(str(versions[name]) for name in names),
+            cacheable=self.cacheable)
+        if built:
+            return response
+        return get_conditional_response(
+            request, etag=response.get('ETag'), response=response)
+
+    @staticmethod
+    def cacheable(response):
+        # Устаревшая копия из stale_if_error помечена заголовком Warning
+        return (response.status_code == 200 and not response.cookies
+                and not response.has_header('Warning'))
+
+    def page(self, request):
+        """Версии страницы и параметры ее ключа или None, если ее нельзя
+        брать из кеша."""
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        if (settings.SESSION_COOKIE_NAME in request.COOKIES
+                or 'messages' in request.COOKIES):
+            return None
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        if match.view_name not in PAGES:
+            return None
+        versions, params = PAGES[match.view_name]
+        return versions(match.kwargs), params
+
+    @staticmethod
+    def make_public(response):
+        headers = (header.strip()
+                   for header in response.get('Vary', '').split(','))
+        vary = [header for header in headers
+                if header and header.lower() != 'cookie']
+        del response['Vary']
+        if vary:
+            patch_vary_headers(response, vary)
+        patch_cache_control(response, public=True, max_age=0,
+                            s_maxage=settings.PAGE_CACHE_MAX_AGE)
+
+
+class MetricsMiddleware:
+    """Замеры запроса для ``posts.metrics``; ставится первой, чтобы время
+    ответа включало остальные прослойки."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = metrics.start_request()
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(metrics.count_query))
+                return self.get_response(request)
+        finally:
+            metrics.finish_request(request, stats,
+                                   time.perf_counter() - start)
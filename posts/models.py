@@ -1,6 +1,9 @@
 from django.db import models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
 
+from .storage import ContentAddressedStorage
 
 User = get_user_model()
 
@@ -39,6 +42,37 @@ class Group(models.Model):
         super().save(*args, **kwargs)
 
 
+class FeedManager(models.Manager):
+    """Посты для карточек ленты: автор и группа подгружаются одним
+    запросом вместе с числом комментариев, а колонки, которые карточка
+    не показывает, не выбираются.
+
+    Через этот менеджер идут все ленты, поэтому его запрос не должен
+    группировать посты: тогда LIMIT страницы срабатывает до сортировки.
+    """
+    deferred_fields = (
+        'author__password', 'author__last_login', 'author__is_superuser',
+        'author__first_name', 'author__last_name', 'author__email',
+        'author__is_staff', 'author__is_active', 'author__date_joined',
+        'group__description',
+    )
+
+    def get_queryset(self):
+        return (super().get_queryset()
+                .select_related('author', 'group')
+                .defer(*self.deferred_fields)
+                .annotate(comment_count=self.comment_count()))
+
+    @staticmethod
+    def comment_count():
+        # Подзапрос на каждую строку, а не JOIN с GROUP BY: иначе база
+        # группирует и сортирует все подходящие посты до LIMIT страницы
+        comments = (Comment.objects.filter(post=OuterRef('pk')).order_by()
+                    .values('post').annotate(total=Count('pk'))
+                    .values('total'))
+        return Coalesce(Subquery(comments, output_field=IntegerField()), 0)
+
+
 class Post(models.Model):
     text = models.TextField(verbose_name='Текст',
                             help_text='Напишите здесь что-либо'
@@ -61,7 +95,15 @@ class Post(models.Model):
                               help_text=('Здесь можно выбрать группу для '
                                          'публикации')
                               )
-    image = models.ImageField(upload_to='posts/', blank=True, null=True)
+    image = models.ImageField(upload_to='posts/',
+                              storage=ContentAddressedStorage(),
+                              blank=True, null=True,
+                              # Файл удаляется, когда на него не ссылается
+                              # ни один пост
+                              db_index=True)
+
+    objects = models.Manager()
+    feed = FeedManager()
 
     def __str__(self):
         return self.text[:15]
@@ -91,3 +133,42 @@ class Follow(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['user', 'author'],
                                     name='user_follow')]
+
+
+class Timeline(models.Model):
+    """Материализованная лента подписок: пост автора, на которого
+    подписан пользователь. Заполняется при публикации поста.
+
+    Дата поста скопирована в строку, чтобы страница ленты читалась по
+    индексу (user, -pub_date) без сортировки всех постов подписок."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='timeline')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE,
+                             related_name='timeline')
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'],
+                                    name='user_timeline_post')]
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-post'],
+                         name='timeline_user_pub_date')]
+
+
+class UserStats(models.Model):
+    """Счетчики профиля, которые обновляются при создании и удалении
+    постов и подписок, чтобы не считать их на каждый просмотр."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE,
+                                primary_key=True, related_name='stats')
+    posts_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+
+
+class GroupStats(models.Model):
+    """Число постов группы, которое обновляется при создании, удалении и
+    переносе постов, чтобы страница группы не считала их каждый раз."""
+    group = models.OneToOneField(Group, on_delete=models.CASCADE,
+                                 primary_key=True, related_name='stats')
+    posts_count = models.PositiveIntegerField(default=0)
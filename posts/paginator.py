@@ -0,0 +1,214 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+
+from django.conf import settings
+from django.core.paginator import Page, Paginator
+from django.db.models import Max, Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class CursorPaginator(Paginator):
+    """Keyset-пагинация ленты по паре (pub_date, id).
+
+    Страница выбирается условием по ключу последней (или первой) записи
+    соседней страницы, поэтому запрос не использует OFFSET и не требует
+    COUNT(*): его стоимость не зависит от глубины страницы. Номер страницы
+    передается внутри курсора и нужен только для отображения.
+
+    Свойство ``count`` по-прежнему считает записи точно, но вызывается
+    только если кто-то к нему обратится.
+    """
+    keyset = True
+
+    def __init__(self, object_list, per_page, orphans=0,
+                 allow_empty_first_page=True):
+        super().__init__(object_list.order_by('-pub_date', '-pk'), per_page,
+                         orphans, allow_empty_first_page)
+        self._num_pages = 1
+
+    @property
+    def num_pages(self):
+        """Номер последней известной страницы: текущая или следующая."""
+        return self._num_pages
+
+    def get_page(self, number=None, cursor=None):
+        """Вернуть страницу по курсору, а без него — по номеру страницы.
+
+        Номер страницы поддерживается для старых ссылок вида ``?page=N``
+        и работает через OFFSET. Некорректный курсор или номер ведут на
+        первую страницу.
+        """
+        position = decode_cursor(cursor)
+        if position is not None:
+            number, direction, pub_date, pk = position
+            if direction == PREVIOUS:
+                return self._previous_page(number, pub_date, pk)
+            return self._next_page(number, pub_date, pk)
+        try:
+            number = max(int(number), 1)
+        except (TypeError, ValueError):
+            number = 1
+        bottom = (number - 1) * self.per_page
+        rows = self.fetch(self.per_page + 1, offset=bottom)
+        if not rows and number > 1:
+            return self.get_page()
+        return self._build_page(rows[:self.per_page], number,
+                                len(rows) > self.per_page)
+
+    def fetch(self, limit, offset=0, after=None, before=None):
+        """Записи в порядке ленты: ``limit`` записей после ``offset``
+        или после ключа ``after``, либо ``limit`` ближайших записей перед
+        ключом ``before``. Ключ — пара (pub_date, id)."""
+        queryset = self.object_list
+        if before is not None:
+            rows = list(queryset.filter(keyset_before(*before))
+                        .reverse()[:limit])
+            rows.reverse()
+            return rows
+        if after is not None:
+            queryset = queryset.filter(keyset_after(*after))
+        return list(queryset[offset:offset + limit])
+
+    def _next_page(self, number, pub_date, pk):
+        rows = self.fetch(self.per_page + 1, after=(pub_date, pk))
+        if not rows:
+            return self.get_page()
+        return self._build_page(rows[:self.per_page], number,
+                                len(rows) > self.per_page)
+
+    def _previous_page(self, number, pub_date, pk):
+        rows = self.fetch(self.per_page, before=(pub_date, pk))
+        if number <= 1 or len(rows) < self.per_page:
+            return self.get_page()
+        return self._build_page(rows, number, True)
+
+    def dump_page(self, page):
+        """Состояние страницы для кеша: id записей, номер страницы и
+        есть ли следующая."""
+        return [obj.pk for obj in page], page.number, page.has_next()
+
+    def load_page(self, state, queryset):
+        """Восстановить страницу из ``dump_page``, выбрав записи из
+        ``queryset`` по первичному ключу. Удаленные записи пропускаются."""
+        ids, number, has_next = state
+        objects = queryset.in_bulk(ids)
+        return self._build_page([objects[pk] for pk in ids if pk in objects],
+                                number, has_next)
+
+    def _build_page(self, object_list, number, has_next):
+        self._num_pages = number + 1 if has_next else number
+        page = Page(object_list, number, self)
+        page.next_cursor = None
+        page.previous_cursor = None
+        if has_next and object_list:
+            page.next_cursor = encode_cursor(number + 1, NEXT,
+                                             object_list[-1])
+        if number > 2 and object_list:
+            page.previous_cursor = encode_cursor(number - 1, PREVIOUS,
+                                                 object_list[0])
+        elif number > 1:
+            page.previous_cursor = ''
+        return page
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator без точного COUNT(*) по большой таблице.
+
+    Без фильтров число записей оценивается по наибольшему первичному ключу:
+    это один шаг по индексу, а удаленные записи лишь немного завышают
+    оценку. С фильтрами записи считаются точно, но не больше
+    ``ESTIMATED_COUNT_LIMIT``: дальше этой границы страницы не показываются.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list.order_by()
+        if not queryset.query.where:
+            return queryset.aggregate(top=Max('pk'))['top'] or 0
+        return queryset[:settings.ESTIMATED_COUNT_LIMIT].count()
+
+
+class StoredCountPaginator(Paginator):
+    """Paginator, который берет число записей из счетчика.
+
+    Счетчик (``UserStats.posts_count``, ``GroupStats.posts_count``)
+    обновляется при создании и удалении постов, так что COUNT(*) на каждый
+    просмотр не нужен. Небольшие наборы, не больше ``EXACT_COUNT_LIMIT``
+    записей, считаются точно: это дешево и исправляет расхождение
+    счетчика до запуска ``recount_stats``. Когда показывается сам счетчик,
+    вызывается ``refresh``, который может пересчитать его в фоне.
+    """
+
+    def __init__(self, object_list, per_page, stored_count, refresh=None,
+                 **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.stored_count = stored_count
+        self.refresh = refresh
+
+    @cached_property
+    def count(self):
+        if self.stored_count is None:
+            return super().count
+        if self.stored_count <= settings.EXACT_COUNT_LIMIT:
+            return (self.object_list.order_by()
+                    [:settings.EXACT_COUNT_LIMIT + 1].count())
+        if self.refresh is not None:
+            self.refresh()
+        return self.stored_count
+
+
+def keyset_after(pub_date, pk, field='pk'):
+    """Условие на записи после ключа (pub_date, id) в порядке ленты."""
+    return (Q(pub_date__lte=pub_date)
+            & ~Q(pub_date=pub_date, **{field + '__gte': pk}))
+
+
+def keyset_before(pub_date, pk, field='pk'):
+    """Условие на записи перед ключом (pub_date, id) в порядке ленты."""
+    return (Q(pub_date__gte=pub_date)
+            & ~Q(pub_date=pub_date, **{field + '__lte': pk}))
+
+
+def encode_cursor(number, direction, obj):
+    raw = '{}|{}|{}|{}'.format(number, direction, obj.pub_date.isoformat(),
+                               obj.pk)
+    return urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def position_key(number=None, cursor=None):
+    """Позиция страницы для ключа кеша.
+
+    Курсор входит в ключ разобранным, вместе с ключом записи, от которой
+    отсчитывается страница: курсор с чужим номером страницы не попадет в
+    кеш под этим номером. Без курсора — номер страницы: не число дает
+    первую страницу, а номер меньше единицы остается как есть, потому что
+    ``Paginator.get_page`` показывает по нему последнюю страницу.
+    """
+    position = decode_cursor(cursor)
+    if position is not None:
+        number, direction, pub_date, pk = position
+        return '%s:%s:%s:%s' % (number, direction, pub_date.isoformat(), pk)
+    try:
+        return str(int(number))
+    except (TypeError, ValueError):
+        return '1'
+
+
+def decode_cursor(cursor):
+    """Разобрать курсор в (номер, направление, pub_date, id) или None."""
+    if not cursor:
+        return None
+    try:
+        raw = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        number, direction, pub_date, pk = raw.split('|')
+        number, pk = int(number), int(pk)
+        pub_date = parse_datetime(pub_date)
+    except (BinasciiError, UnicodeDecodeError, ValueError):
+        return None
+    if pub_date is None or direction not in (NEXT, PREVIOUS) or number < 1:
+        return None
+    return number, direction, pub_date, pk
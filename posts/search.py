@@ -0,0 +1,91 @@
+"""Полнотекстовый поиск по постам на индексе SQLite FTS5.
+
+Индекс ``posts_post_fts`` хранит только токены: текст берется из
+``posts_post`` (external content), а синхронность поддерживают триггеры
+на вставку, удаление и изменение текста, поэтому индекс верен при любом
+способе записи, включая ``bulk_create`` и ``update``. Таблица и триггеры
+создаются после миграций приложения и заполняются существующими постами.
+
+На других СУБД поиск работает через ``icontains`` без ранжирования.
+"""
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models.expressions import RawSQL
+
+TABLE = 'posts_post_fts'
+
+SCHEMA = tuple(statement.format(table=TABLE) for statement in (
+    """CREATE VIRTUAL TABLE {table} USING fts5(
+        text, content='posts_post', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER {table}_insert AFTER INSERT ON posts_post BEGIN
+        INSERT INTO {table} (rowid, text) VALUES (NEW.id, NEW.text);
+    END""",
+    """CREATE TRIGGER {table}_delete AFTER DELETE ON posts_post BEGIN
+        INSERT INTO {table} ({table}, rowid, text)
+        VALUES ('delete', OLD.id, OLD.text);
+    END""",
+    """CREATE TRIGGER {table}_update AFTER UPDATE OF text ON posts_post
+    BEGIN
+        INSERT INTO {table} ({table}, rowid, text)
+        VALUES ('delete', OLD.id, OLD.text);
+        INSERT INTO {table} (rowid, text) VALUES (NEW.id, NEW.text);
+    END""",
+    "INSERT INTO {table} ({table}) VALUES ('rebuild')",
+))
+
+WORD = re.compile(r'\w+')
+
+
+def is_available(using=DEFAULT_DB_ALIAS):
+    return connections[using].vendor == 'sqlite'
+
+
+def install(using=DEFAULT_DB_ALIAS):
+    """Создать индекс и триггеры, если их еще нет."""
+    connection = connections[using]
+    if not is_available(using):
+        return
+    if TABLE in connection.introspection.table_names():
+        return
+    with connection.cursor() as cursor:
+        for statement in SCHEMA:
+            cursor.execute(statement)
+
+
+def match_expression(query):
+    """Запрос FTS5 из пользовательского ввода.
+
+    Каждое слово ищется как префикс, все слова обязательны. Кавычки не
+    дают синтаксису FTS5 из ввода попасть в запрос.
+    """
+    return ' '.join('"%s"*' % word for word in WORD.findall(query.lower()))
+
+
+def matching(queryset, query):
+    """Посты ``queryset``, подходящие под ``query``, без сортировки."""
+    expression = match_expression(query)
+    if not expression:
+        return queryset.none()
+    if not is_available(queryset.db):
+        return queryset.filter(text__icontains=query)
+    # RawSQL в pk__in оборачивается в лишние скобки, и SQLite сравнивает
+    # id только с первой строкой подзапроса
+    return queryset.extra(
+        where=['posts_post.id IN (SELECT rowid FROM {0} '
+               'WHERE {0} MATCH %s)'.format(TABLE)],
+        params=[expression])
+
+
+def search(queryset, query):
+    """Посты ``queryset``, подходящие под ``query``, от более
+    релевантных к менее."""
+    posts = matching(queryset, query)
+    expression = match_expression(query)
+    if not expression or not is_available(queryset.db):
+        return posts.order_by('-pub_date', '-pk')
+    rank = ('SELECT rank FROM {0} WHERE {0} MATCH %s '
+            'AND rowid = posts_post.id').format(TABLE)
+    return (posts.annotate(rank=RawSQL(rank, [expression]))
+            .order_by('rank', '-pub_date', '-pk'))
@@ -0,0 +1,124 @@
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from posts import media, stats, thumbnails, timeline
+from posts.caching import bump, bump_post_pages, page_versions
+from posts.models import Comment, Follow, Group, Post
+
+
+@receiver(pre_save, sender=Post)
+def post_saving(sender, instance, update_fields=None, **kwargs):
+    # Картинка, которую заменяет правка, освобождается после сохранения,
+    # а при переносе в другую группу меняются счетчики групп
+    if instance.pk and (update_fields is None or 'image' in update_fields
+                        or 'group' in update_fields):
+        instance._previous = (Post.objects.filter(pk=instance.pk)
+                              .values('image', 'group_id', 'group__slug')
+                              .first())
+
+
+def post_pages(post):
+    """Версии целых страниц, на которых виден пост."""
+    return page_versions(post.author.username,
+                         post.group.slug if post.group_id else None)
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    # post_pages включает index
+    bump(*post_pages(instance))
+    if created:
+        stats.increment(instance.author_id, 'posts_count')
+        if instance.group_id:
+            stats.increment_group(instance.group_id)
+        timeline.fan_out(instance)
+        bump('posts-by:%s' % instance.author_id)
+    else:
+        bump('post:%s' % instance.pk)
+        previous = getattr(instance, '_previous', None) or {}
+        image = previous.get('image')
+        if image and image != instance.image.name:
+            transaction.on_commit(partial(media.release, image))
+        group_id = previous.get('group_id', instance.group_id)
+        if group_id != instance.group_id:
+            if group_id:
+                stats.decrement_group(group_id)
+            if instance.group_id:
+                stats.increment_group(instance.group_id)
+            if previous.get('group__slug'):
+                # Пост ушел со страницы прежней группы
+                bump('group-page:%s' % previous['group__slug'])
+    thumbnails.schedule(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    stats.decrement(instance.author_id, 'posts_count')
+    if instance.group_id:
+        stats.decrement_group(instance.group_id)
+    bump('post:%s' % instance.pk, 'posts-by:%s' % instance.author_id,
+         *post_pages(instance))
+    if instance.image:
+        transaction.on_commit(partial(media.release, instance.image.name))
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        stats.increment(instance.author_id, 'followers_count')
+        stats.increment(instance.user_id, 'following_count')
+        timeline.followers_changed(instance.author_id)
+        timeline.backfill(instance.user_id, instance.author_id)
+        bump('feed:%s' % instance.user_id,
+             'profile:%s' % instance.author.username,
+             'profile:%s' % instance.user.username)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    stats.decrement(instance.author_id, 'followers_count')
+    stats.decrement(instance.user_id, 'following_count')
+    timeline.followers_changed(instance.author_id)
+    timeline.prune(instance.user_id, instance.author_id)
+    bump('feed:%s' % instance.user_id,
+         'profile:%s' % instance.author.username,
+         'profile:%s' % instance.user.username)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed(sender, instance, **kwargs):
+    bump('post:%s' % instance.post_id)
+    # Счетчик комментариев на карточках главной, профиля и группы
+    bump_post_pages(instance.post_id)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    # names — имена групп и пользователей на страницах постов
+    bump('index', 'group:%s' % instance.pk, 'names')
+
+
+@receiver(pre_save, sender=settings.AUTH_USER_MODEL)
+def user_saving(sender, instance, update_fields=None, **kwargs):
+    # Карточки и страницы постов показывают только username
+    if instance.pk and (update_fields is None or 'username' in update_fields):
+        instance._previous_username = (
+            sender.objects.filter(pk=instance.pk)
+            .values_list('username', flat=True).first())
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_saved(sender, instance, created, **kwargs):
+    # У нового пользователя нет карточек, а вход, смена пароля и правка
+    # профиля без смены имени их не меняют
+    if created:
+        return
+    previous = getattr(instance, '_previous_username', None)
+    if previous is not None and previous != instance.username:
+        bump('index', 'author:%s' % instance.pk, 'names')
@@ -0,0 +1,99 @@
+"""Денормализованные счетчики профиля пользователя и группы.
+
+Счетчики меняются вместе с постами и подписками, но могут разойтись с
+таблицами, например после сбоя между записью и обновлением счетчика. Число
+постов больших профилей и групп, которое показывается без пересчета,
+поэтому пересчитывается в фоне не чаще раза в ``STATS_REFRESH_INTERVAL``
+секунд (``refresh`` и ``refresh_group``); ``recount_stats`` сверяет все
+счетчики разом.
+"""
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from posts.background import Pool
+from posts.models import Follow, GroupStats, Post, UserStats
+
+pool = Pool('stats')
+
+
+def count(user_id):
+    return {
+        'posts_count': Post.objects.filter(author_id=user_id).count(),
+        'followers_count': Follow.objects.filter(author_id=user_id).count(),
+        'following_count': Follow.objects.filter(user_id=user_id).count(),
+    }
+
+
+def recount(user_id):
+    """Пересчитать счетчики пользователя и сохранить их."""
+    stats, created = UserStats.objects.update_or_create(
+        user_id=user_id, defaults=count(user_id))
+    return stats
+
+
+def increment(user_id, field):
+    updated = UserStats.objects.filter(user_id=user_id).update(
+        **{field: F(field) + 1})
+    if not updated:
+        # Строки еще нет: считаем с нуля, новый объект уже в базе
+        try:
+            with transaction.atomic():
+                UserStats.objects.create(user_id=user_id, **count(user_id))
+        except IntegrityError:
+            increment(user_id, field)
+
+
+def decrement(user_id, field):
+    # Строку не создаем: при каскадном удалении пользователя ее создание
+    # нарушило бы внешний ключ, а расхождение исправит recount_stats
+    UserStats.objects.filter(user_id=user_id, **{field + '__gt': 0}).update(
+        **{field: F(field) - 1})
+
+
+def recount_group(group_id):
+    """Пересчитать число постов группы и сохранить его."""
+    stats, created = GroupStats.objects.update_or_create(
+        group_id=group_id, defaults={
+            'posts_count': Post.objects.filter(group_id=group_id).count()})
+    return stats
+
+
+def increment_group(group_id):
+    updated = GroupStats.objects.filter(group_id=group_id).update(
+        posts_count=F('posts_count') + 1)
+    if not updated:
+        try:
+            with transaction.atomic():
+                GroupStats.objects.create(
+                    group_id=group_id,
+                    posts_count=Post.objects.filter(group_id=group_id).count())
+        except IntegrityError:
+            increment_group(group_id)
+
+
+def decrement_group(group_id):
+    GroupStats.objects.filter(group_id=group_id, posts_count__gt=0).update(
+        posts_count=F('posts_count') - 1)
+
+
+def schedule(name, task, *args):
+    """Выполнить пересчет в фоне после фиксации транзакции, если для
+    ``name`` его не запускали последние ``STATS_REFRESH_INTERVAL``
+    секунд."""
+    if cache.add('stats-refresh:%s' % name, 1,
+                 settings.STATS_REFRESH_INTERVAL):
+        transaction.on_commit(partial(pool.submit, task, *args))
+
+
+def refresh(user_id):
+    """Пересчитать счетчики пользователя в фоне."""
+    schedule('user:%s' % user_id, recount, user_id)
+
+
+def refresh_group(group_id):
+    """Пересчитать число постов группы в фоне."""
+    schedule('group:%s' % group_id, recount_group, group_id)
@@ -0,0 +1,69 @@
+"""Хранилище картинок постов с адресацией по содержимому.
+
+Файл называется по SHA-256 содержимого, поэтому одинаковые загрузки
+хранятся один раз, а sorl, который именует миниатюры по имени исходного
+файла, создает для них один набор миниатюр. Файл удаляется, когда на него
+не ссылается ни один пост: см. ``posts.media.release``.
+"""
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        name = posixpath.join(posixpath.dirname(name),
+                              digest.hexdigest()
+                              + os.path.splitext(name)[1].lower())
+        return super().save(name, content, max_length)
+
+    def get_available_name(self, name, max_length=None):
+        # Занятое имя означает то же содержимое: файл переиспользуется
+        return name
+
+    def _save(self, name, content):
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            # Свежая дата изменения защищает файл от удаления, пока пост
+            # с повторной загрузкой еще не сохранен
+            os.utime(full_path)
+            return name
+        directory = os.path.dirname(full_path)
+        if self.directory_permissions_mode is not None:
+            old_umask = os.umask(0)
+            try:
+                os.makedirs(directory, self.directory_permissions_mode,
+                            exist_ok=True)
+            finally:
+                os.umask(old_umask)
+        else:
+            os.makedirs(directory, exist_ok=True)
+        # Файл пишется рядом под временным именем и переименовывается
+        # атомарно: параллельная загрузка того же содержимого не увидит
+        # недописанный файл
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as output:
+                for chunk in content.chunks():
+                    output.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(temporary, self.file_permissions_mode)
+            os.replace(temporary, full_path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+            raise
+        return name
@@ -0,0 +1,48 @@
+from django import template
+from django.core.cache.utils import make_template_fragment_key
+
+from posts.caching import remember
+
+register = template.Library()
+
+
+class RememberNode(template.Node):
+    def __init__(self, nodelist, timeout, name, vary_on, version):
+        self.nodelist = nodelist
+        self.timeout = timeout
+        self.name = name
+        self.vary_on = vary_on
+        self.version = version
+
+    def render(self, context):
+        key = make_template_fragment_key(
+            self.name, [var.resolve(context) for var in self.vary_on])
+        version = self.version.resolve(context) if self.version else None
+        return remember(key, lambda: self.nodelist.render(context),
+                        int(self.timeout.resolve(context)), version,
+                        name=self.name)
+
+
+@register.tag
+def remember_fragment(parser, token):
+    """Фрагмент шаблона в кеше через ``posts.caching.remember``.
+
+    ``{% remember_fragment timeout name [vary_on ...] version=var %}``
+    В отличие от ``{% cache %}`` версия не входит в ключ: после ее сброса
+    фрагмент перестраивает один запрос, а остальные получают прежний.
+    """
+    nodelist = parser.parse(('endremember_fragment',))
+    parser.delete_first_token()
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(
+            "'%r' tag requires at least 2 arguments." % bits[0])
+    version = None
+    vary_on = []
+    for bit in bits[3:]:
+        if bit.startswith('version='):
+            version = parser.compile_filter(bit[len('version='):])
+        else:
+            vary_on.append(parser.compile_filter(bit))
+    return RememberNode(nodelist, parser.compile_filter(bits[1]), bits[2],
+                        vary_on, version)
@@ -0,0 +1,26 @@
+from django import template
+
+register = template.Library()
+
+
+@register.simple_tag
+def page_window(page, size=2):
+    """Номера страниц для навигации: первая, последняя и ``size`` страниц
+    по обе стороны от текущей. Пропуски обозначены None.
+
+    Число элементов не зависит от общего числа страниц, в отличие от
+    ``paginator.page_range``.
+    """
+    last = page.paginator.num_pages
+    window = range(max(page.number - size, 1),
+                   min(page.number + size, last) + 1)
+    numbers = sorted({1, last, *window})
+    pages = []
+    for number in numbers:
+        if pages and number - pages[-1] == 2:
+            # Пропуск в одну страницу короче многоточия
+            pages.append(number - 1)
+        elif pages and number - pages[-1] > 2:
+            pages.append(None)
+        pages.append(number)
+    return pages
@@ -0,0 +1,71 @@
+import re
+
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from posts.caching import get_versions
+from posts.metrics import record_cache
+from posts.thumbnails import feed_picture, prefetch
+
+register = template.Library()
+
+EDIT_MARKER = re.compile(r'<!--post-edit:(\d+):(\d+)-->')
+
+
+def card_versions(post):
+    return ('post:%s' % post.pk, 'author:%s' % post.author_id,
+            'group:%s' % post.group_id)
+
+
+@register.simple_tag
+def post_cards(posts):
+    """HTML карточек постов страницы.
+
+    Карточки берутся из кеша одним запросом, шаблон рендерится только для
+    отсутствующих, а миниатюры для них подгружаются заранее одним
+    запросом. Ключ карточки включает версии поста, автора и группы.
+    Карточки одинаковы для всех пользователей: кнопку редактирования
+    подставляет фильтр ``with_edit_buttons``.
+    """
+    posts = list(posts)
+    versions = get_versions(*{name for post in posts
+                              for name in card_versions(post)})
+    keys = {}
+    for post in posts:
+        version = '.'.join(str(versions[name])
+                           for name in card_versions(post))
+        keys[post.pk] = 'post-card:%s:%s' % (post.pk, version)
+    cards = cache.get_many(keys.values())
+    record_cache('post-card', hits=len(cards),
+                 misses=len(keys) - len(cards))
+    missing = {}
+    prefetch(post for post in posts if keys[post.pk] not in cards)
+    for post in posts:
+        if keys[post.pk] not in cards:
+            missing[keys[post.pk]] = render_to_string(
+                'posts/post_item.html', {'post': post, 'shared': True})
+    if missing:
+        cache.set_many(missing, settings.POST_CARD_CACHE_TIMEOUT)
+        cards.update(missing)
+    return [mark_safe(cards[keys[post.pk]]) for post in posts]
+
+
+@register.filter
+def with_edit_buttons(html, user):
+    """Подставить кнопки редактирования в посты пользователя ``user``."""
+    def replace(match):
+        author_id, post_id = match.groups()
+        if not user.is_authenticated or int(author_id) != user.pk:
+            return ''
+        return render_to_string('posts/edit_button.html', {
+            'username': user.username, 'post_id': post_id})
+    return mark_safe(EDIT_MARKER.sub(replace, html))
+
+
+@register.simple_tag
+def post_picture(post):
+    """Варианты миниатюры карточки или None, пока они создаются."""
+    return feed_picture(post)
@@ -0,0 +1,69 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import Follow, Post
+from posts.paginator import EstimatedCountPaginator
+
+User = get_user_model()
+
+
+class AdminChangelistTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.test_admin = User.objects.create_superuser(
+            username='admin', email='admin@test.com', password='12345678')
+        cls.test_author = User.objects.create_user(username='author')
+        Post.objects.bulk_create(Post(text='Пост %s' % i,
+                                      author=cls.test_author)
+                                 for i in range(3))
+        Post.objects.create(text='Пост админа', author=cls.test_admin)
+        Follow.objects.create(user=cls.test_admin, author=cls.test_author)
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.test_admin)
+
+    def test_post_changelist_has_no_per_row_queries(self):
+        """Список постов не делает запросов на каждую строку и не
+        считает всю таблицу"""
+        url = reverse('admin:posts_post_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 4)
+        user_queries = [query for query in queries.captured_queries
+                        if 'FROM "auth_user"' in query['sql']]
+        # только пользователь сессии
+        self.assertEqual(len(user_queries), 1)
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'COUNT(*)' in query['sql']
+                          and 'LIMIT' not in query['sql']])
+
+    def test_author_filter_uses_username(self):
+        """Фильтр по автору принимает имя пользователя"""
+        response = self.client.get(reverse('admin:posts_post_changelist'),
+                                   {'author': 'author'})
+        self.assertEqual(response.context['cl'].result_count, 3)
+        self.assertContains(response, 'name="author" value="author"')
+
+    def test_follow_changelist_joins_users(self):
+        """Подписки выбираются вместе с пользователями одним запросом"""
+        url = reverse('admin:posts_follow_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        user_queries = [query for query in queries.captured_queries
+                        if 'FROM "auth_user"' in query['sql']]
+        # только пользователь сессии
+        self.assertEqual(len(user_queries), 1)
+
+    def test_estimated_count_is_capped(self):
+        """С фильтром записи считаются не дальше заданной границы"""
+        with self.settings(ESTIMATED_COUNT_LIMIT=2):
+            paginator = EstimatedCountPaginator(
+                Post.objects.filter(author=self.test_author), 1)
+            self.assertEqual(paginator.count, 2)
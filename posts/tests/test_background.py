@@ -0,0 +1,29 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from posts import background
+
+
+class BackgroundTest(SimpleTestCase):
+    def test_run_logs_error_and_closes_connections(self):
+        """Ошибка задачи пишется в журнал, соединения закрываются"""
+        task = mock.Mock(side_effect=ValueError('сбой'))
+        with mock.patch('posts.background.close_old_connections') as close, \
+                self.assertLogs('posts.background', 'ERROR'):
+            background.run(task, 1, 2)
+        task.assert_called_once_with(1, 2)
+        close.assert_called_once_with()
+
+    @override_settings(THUMBNAIL_WORKERS=3)
+    def test_pool_reads_workers_from_setting(self):
+        """Пул создается при первой задаче с числом потоков из настройки
+        и выполняет задачи через run"""
+        pool = background.Pool('test', 'THUMBNAIL_WORKERS')
+        self.assertIs(pool.executor(), pool.executor())
+        self.assertEqual(pool.executor()._max_workers, 3)
+        task = mock.Mock()
+        with mock.patch('posts.background.close_old_connections'):
+            pool.submit(task, 'x')
+            pool.executor().shutdown(wait=True)
+        task.assert_called_once_with('x')
@@ -0,0 +1,63 @@
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from posts.caching import remember
+
+
+class RememberTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return 'value %s' % self.calls
+
+    def test_fresh_value_is_computed_once(self):
+        """Свежая запись не перестраивается"""
+        self.assertEqual(remember('key', self.compute, 60, 1), 'value 1')
+        self.assertEqual(remember('key', self.compute, 60, 1), 'value 1')
+        self.assertEqual(self.calls, 1)
+
+    def test_new_version_rebuilds(self):
+        """Запись с прежней версией перестраивается"""
+        remember('key', self.compute, 60, 1)
+        self.assertEqual(remember('key', self.compute, 60, 2), 'value 2')
+
+    def test_stale_value_is_served_while_locked(self):
+        """Пока другой процесс строит запись, отдается прежняя"""
+        remember('key', self.compute, 60, 1)
+        cache.add('lock:key', 1)
+        self.assertEqual(remember('key', self.compute, 60, 2), 'value 1')
+        self.assertEqual(self.calls, 1)
+
+    def test_missing_value_is_computed_without_waiting(self):
+        """Без прежней записи заблокированный ключ строится сразу и не
+        сохраняется"""
+        cache.add('lock:key', 1)
+        start = time.time()
+        self.assertEqual(remember('key', self.compute, 60, 1), 'value 1')
+        self.assertLess(time.time() - start, 1)
+        self.assertIsNone(cache.get('key'))
+
+    def test_lock_is_released(self):
+        """Блокировка снимается после построения"""
+        remember('key', self.compute, 60, 1)
+        self.assertIsNone(cache.get('lock:key'))
+
+    def test_early_refresh(self):
+        """Запись, которая строится долго, обновляется до истечения срока"""
+        cache.set('key', (1, 'old', time.time() + 10, 5.0))
+        with mock.patch('posts.caching.random.random', return_value=1e-9):
+            self.assertEqual(remember('key', self.compute, 60, 1), 'value 1')
+        with mock.patch('posts.caching.random.random', return_value=1.0):
+            self.assertEqual(remember('key', self.compute, 60, 1), 'value 1')
+        self.assertEqual(self.calls, 1)
+
+    def test_uncacheable_value_is_not_stored(self):
+        """Значение, отклоненное cacheable, не сохраняется"""
+        remember('key', self.compute, 60, 1, cacheable=lambda value: False)
+        self.assertIsNone(cache.get('key'))
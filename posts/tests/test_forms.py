@@ -1,10 +1,13 @@
 import shutil
 import tempfile
+from io import BytesIO
+
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
+from PIL import Image
 
 from posts.forms import PostForm
 from posts.models import Post, Group
@@ -88,12 +91,9 @@ class PostFormTest(TestCase):
         )
         self.assertEqual(posts_count + 1, Post.objects.count())
         self.assertRedirects(response, reverse('posts:index'))
-        self.assertTrue(
-            Post.objects.filter(
-                text='Текст из формы',
-                image='posts/small.gif'
-            ).exists()
-        )
+        # Картинка хранится под хешем содержимого
+        self.assertRegex(Post.objects.get(text='Текст из формы').image.name,
+                         r'^posts/[0-9a-f]{64}\.gif$')
 
     def test_username_post_edit(self):
         """Проверяет что запись изменяется, а не публикуется новая """
@@ -110,3 +110,61 @@ class PostFormTest(TestCase):
         self.assertEqual(post_count, Post.objects.count())
         self.assertRedirects(response, reverse(
             'posts:post', kwargs={'username': 'tester', 'post_id': '1'}))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, IMAGE_MAX_SIDE=100)
+class ImageNormalizationTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.test_user = User.objects.create_user(username='uploader')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.test_user)
+
+    @staticmethod
+    def jpeg(size, orientation=None):
+        image = Image.new('RGB', size, (200, 30, 30))
+        exif = Image.Exif()
+        if orientation:
+            exif[0x0112] = orientation
+        exif[0x010F] = 'Camera'
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', exif=exif.tobytes())
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(),
+                                  content_type='image/jpeg')
+
+    def test_upload_is_resized_rotated_and_stripped(self):
+        """Картинка уменьшается, поворачивается по EXIF и теряет
+        метаданные"""
+        self.authorized_client.post(reverse('posts:new_post'), data={
+            'text': 'Фото', 'image': self.jpeg((400, 200), orientation=6)})
+        post = Post.objects.get(text='Фото')
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.size, (50, 100))
+            self.assertEqual(image.format, 'JPEG')
+            self.assertNotIn('exif', image.info)
+
+    @override_settings(IMAGE_MAX_PIXELS=1000)
+    def test_image_bomb_is_rejected(self):
+        """Картинка с огромным числом пикселей не сохраняется"""
+        form = PostForm(data={'text': 'Бомба'},
+                        files={'image': self.jpeg((400, 200))})
+        self.assertFalse(form.is_valid())
+        self.assertIn('image', form.errors)
+
+    def test_truncated_image_is_rejected(self):
+        """Обрезанный JPEG отклоняется формой, а не падает с ошибкой 500"""
+        content = self.jpeg((400, 200)).read()
+        upload = SimpleUploadedFile('photo.jpg', content[:len(content) // 2],
+                                    content_type='image/jpeg')
+        form = PostForm(data={'text': 'Обрезанный'},
+                        files={'image': upload})
+        self.assertFalse(form.is_valid())
+        self.assertIn('image', form.errors)
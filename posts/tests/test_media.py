@@ -0,0 +1,172 @@
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from sorl.thumbnail import default
+
+from posts import media, thumbnails
+from posts.models import Post
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, MEDIA_RELEASE_GRACE=0)
+class ContentAddressedMediaTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.test_user = User.objects.create_user(username='tester')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def create_post(self, name='small.gif'):
+        return Post.objects.create(
+            text='Пост', author=self.test_user,
+            image=SimpleUploadedFile(name=name, content=SMALL_GIF,
+                                     content_type='image/gif'))
+
+    def test_same_upload_is_stored_once(self):
+        """Одинаковые загрузки под разными именами хранятся одним файлом"""
+        first = self.create_post('small.gif')
+        second = self.create_post('copy.GIF')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(os.listdir(os.path.join(TEMP_MEDIA_ROOT, 'posts')),
+                         [os.path.basename(first.image.name)])
+
+    def test_file_is_released_with_last_post(self):
+        """Файл и миниатюры удаляются только вместе с последним постом"""
+        first = self.create_post()
+        second = self.create_post()
+        thumbnails.generate(first.pk, first.image.name)
+        thumbnail = thumbnails.backend.get_cached_thumbnail(
+            first.image, *thumbnails.FEED_THUMBNAILS[0][:1],
+            **thumbnails.FEED_THUMBNAILS[0][1])
+        name = first.image.name
+        first.delete()
+        media.release(name)
+        self.assertTrue(second.image.storage.exists(name))
+        second.delete()
+        media.release(name)
+        self.assertFalse(second.image.storage.exists(name))
+        self.assertFalse(thumbnail.exists())
+
+    @override_settings(MEDIA_RELEASE_GRACE=60)
+    def test_recent_file_is_kept(self):
+        """Недавно загруженный файл не удаляется: его могла повторно
+        загрузить еще не сохраненная форма"""
+        post = self.create_post()
+        name = post.image.name
+        post.delete()
+        media.release(name)
+        self.assertTrue(post.image.storage.exists(name))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, MEDIA_RELEASE_GRACE=60)
+class CollectMediaTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.test_user = User.objects.create_user(username='tester')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        default.kvstore.reset()
+        self.post = Post.objects.create(
+            text='Пост', author=self.test_user,
+            image=SimpleUploadedFile(name='small.gif', content=SMALL_GIF,
+                                     content_type='image/gif'))
+        thumbnails.generate(self.post.pk, self.post.image.name)
+        self.orphan = self.media_file('posts/orphan.gif', b'x' * 10)
+        self.stale = self.media_file('cache/00/11/stale.jpg', b'x' * 5)
+        self.fresh = self.media_file('posts/fresh.gif', b'x', age=0)
+        # Файлы поста тоже старые, но на них есть ссылки
+        for root, _, files in os.walk(TEMP_MEDIA_ROOT):
+            for name in files:
+                os.utime(os.path.join(root, name),
+                         (time.time() - 3600,) * 2)
+        os.utime(self.fresh)
+
+    def tearDown(self):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    @staticmethod
+    def media_file(name, content, age=3600):
+        path = os.path.join(TEMP_MEDIA_ROOT, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(content)
+        os.utime(path, (time.time() - age,) * 2)
+        return path
+
+    def collect(self, *args):
+        out = StringIO()
+        call_command('collect_media', *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_reports_without_deleting(self):
+        """Пробный запуск считает байты, но ничего не удаляет"""
+        output = self.collect('--dry-run')
+        self.assertIn('Можно освободить: 15 байт', output)
+        self.assertTrue(os.path.exists(self.orphan))
+        self.assertTrue(os.path.exists(self.stale))
+
+    def test_unreferenced_files_are_deleted(self):
+        """Удаляются только старые файлы без ссылок и записей"""
+        output = self.collect('--batch-size', '2')
+        self.assertIn('Освобождено: 15 байт', output)
+        self.assertFalse(os.path.exists(self.orphan))
+        self.assertFalse(os.path.exists(self.stale))
+        self.assertTrue(os.path.exists(self.fresh))
+        self.assertTrue(self.post.image.storage.exists(self.post.image.name))
+        thumbnail = thumbnails.cached_thumbnail(
+            self.post, thumbnails.FEED_THUMBNAILS[0][0],
+            **thumbnails.FEED_THUMBNAILS[0][1])
+        self.assertTrue(thumbnail.exists())
+
+    def check_race(self, change):
+        """Файл, который изменился после проверки пачки, не удаляется"""
+        def thumbnails_size(source):
+            # Вызывается между проверкой пачки и удалением файла
+            change()
+            return 0
+
+        with mock.patch('posts.management.commands.collect_media.'
+                        'thumbnails_size', thumbnails_size):
+            output = self.collect()
+        self.assertIn('Освобождено: 5 байт', output)
+        self.assertTrue(os.path.exists(self.orphan))
+
+    def test_file_saved_with_post_during_collect_is_kept(self):
+        self.check_race(lambda: Post.objects.create(
+            text='Пост', author=self.test_user, image='posts/orphan.gif'))
+
+    def test_file_uploaded_again_during_collect_is_kept(self):
+        self.check_race(lambda: os.utime(self.orphan))
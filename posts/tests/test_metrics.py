@@ -0,0 +1,124 @@
+import threading
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from posts import metrics
+from posts.models import Post
+
+User = get_user_model()
+
+
+class RegistryTest(SimpleTestCase):
+    def setUp(self):
+        metrics.registry.clear()
+
+    def test_histogram_is_cumulative(self):
+        """Корзины гистограммы накапливаются, +Inf равна числу замеров"""
+        labels = (('view', 'posts:index'),)
+        for value in (0, 1, 3, 1000):
+            metrics.registry.observe('yatube_db_queries', labels, value)
+        text = metrics.render()
+        for line in (
+                'yatube_db_queries_bucket{view="posts:index",le="0"} 1',
+                'yatube_db_queries_bucket{view="posts:index",le="1"} 2',
+                'yatube_db_queries_bucket{view="posts:index",le="5"} 3',
+                'yatube_db_queries_bucket{view="posts:index",le="+Inf"} 4',
+                'yatube_db_queries_sum{view="posts:index"} 1004',
+                'yatube_db_queries_count{view="posts:index"} 4'):
+            with self.subTest(line=line):
+                self.assertIn(line + '\n', text)
+
+    def test_finished_threads_are_folded(self):
+        """Части завершившихся потоков переносятся в общую и не теряются"""
+        labels = (('view', 'posts:index'),)
+        thread = threading.Thread(target=metrics.registry.increment,
+                                  args=(metrics.CACHE_COUNTER, labels, 2))
+        thread.start()
+        thread.join()
+        metrics.registry.increment(metrics.CACHE_COUNTER, labels)
+        key = (metrics.CACHE_COUNTER, labels)
+        self.assertEqual(metrics.registry.collect()[key], 3)
+        self.assertNotIn(thread, [thread for thread, shard
+                                  in metrics.registry._shards])
+        self.assertEqual(metrics.registry.collect()[key], 3)
+
+    def test_labels_are_escaped(self):
+        """Кавычки и обратная косая черта в метках экранируются"""
+        metrics.registry.increment(metrics.CACHE_COUNTER,
+                                   (('cache', 'a"b\\c'),))
+        self.assertIn('{cache="a\\"b\\\\c"} 1', metrics.render())
+
+
+class MetricsMiddlewareTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.test_user = User.objects.create_user(username='tester')
+        Post.objects.create(text='Пост', author=cls.test_user)
+
+    def setUp(self):
+        cache.clear()
+        metrics.registry.clear()
+        self.guest_client = Client()
+
+    def totals(self, name, view):
+        return metrics.registry.collect()[(name, (('view', view),))]
+
+    def test_request_is_measured(self):
+        """Время ответа, SQL и шаблоны учитываются по имени URL"""
+        self.guest_client.get(reverse('posts:index'))
+        duration = self.totals('yatube_request_duration_seconds',
+                               'posts:index')
+        self.assertEqual(duration[-1], 1)
+        self.assertGreater(duration[-2], 0)
+        self.assertGreater(self.totals('yatube_db_queries',
+                                       'posts:index')[-2], 0)
+        self.assertGreater(self.totals('yatube_template_duration_seconds',
+                                       'posts:index')[-2], 0)
+
+    def test_cache_hits_and_misses(self):
+        """Промах и попадание в кеш страниц учитываются по результату"""
+        url = reverse('posts:index')
+        self.guest_client.get(url)
+        self.guest_client.get(url)
+        totals = metrics.registry.collect()
+        for result in ('hit', 'miss'):
+            with self.subTest(result=result):
+                key = (metrics.CACHE_COUNTER, (
+                    ('view', 'posts:index'), ('cache', 'page'),
+                    ('result', result)))
+                self.assertEqual(totals[key], 1)
+        self.assertEqual(self.totals('yatube_request_duration_seconds',
+                                     'posts:index')[-1], 2)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_endpoint(self):
+        """/metrics отдает метрики в текстовом формате Prometheus"""
+        self.guest_client.get(reverse('posts:index'))
+        response = self.guest_client.get('/metrics',
+                                         HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertContains(
+            response, 'yatube_request_duration_seconds_count'
+                      '{view="posts:index"} 1')
+        self.assertContains(response,
+                            '# TYPE yatube_db_queries histogram')
+
+    def test_metrics_endpoint_requires_token(self):
+        """Без верного токена /metrics недоступна, в том числе с
+        локального адреса"""
+        cases = (
+            ('secret', {}),
+            ('secret', {'HTTP_AUTHORIZATION': 'Bearer wrong'}),
+            ('', {'HTTP_AUTHORIZATION': 'Bearer '}),
+        )
+        for token, headers in cases:
+            with self.subTest(token=token, headers=headers), \
+                    override_settings(METRICS_TOKEN=token):
+                response = self.guest_client.get(
+                    '/metrics', REMOTE_ADDR='127.0.0.1', **headers)
+                self.assertEqual(response.status_code, 404)
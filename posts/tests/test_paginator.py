@@ -0,0 +1,89 @@
+from django.contrib.auth import get_user_model
+from django.core.paginator import Paginator
+from django.test import SimpleTestCase, TestCase
+
+from posts.models import Post
+from posts.paginator import CursorPaginator
+from posts.templatetags.pagination import page_window
+
+User = get_user_model()
+
+
+class CursorPaginatorTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.test_user = User.objects.create_user(username='tester')
+        cls.test_posts = [Post.objects.create(text='Пост %s' % i,
+                                              author=cls.test_user)
+                          for i in range(25)]
+
+    def walk(self):
+        pages = [CursorPaginator(Post.objects.all(), 10).get_page()]
+        while pages[-1].next_cursor:
+            pages.append(CursorPaginator(Post.objects.all(), 10).get_page(
+                cursor=pages[-1].next_cursor))
+        return pages
+
+    def test_cursor_walk_covers_all_posts_once(self):
+        """Переход по курсорам проходит все посты по порядку без повторов"""
+        pages = self.walk()
+        posts = [post for page in pages for post in page]
+        self.assertEqual([page.number for page in pages], [1, 2, 3])
+        self.assertEqual(posts, list(Post.objects.order_by('-pub_date',
+                                                           '-pk')))
+        self.assertFalse(pages[-1].has_next())
+
+    def test_previous_cursor_returns_previous_page(self):
+        """Курсор назад возвращает ту же страницу, что была до перехода"""
+        pages = self.walk()
+        previous = CursorPaginator(Post.objects.all(), 10).get_page(
+            cursor=pages[2].previous_cursor)
+        self.assertEqual(previous.number, 2)
+        self.assertEqual(list(previous), list(pages[1]))
+        self.assertTrue(previous.has_next())
+        self.assertEqual(pages[1].previous_cursor, '')
+
+    def test_page_does_not_count_rows(self):
+        """Глубокая страница выбирается одним запросом без COUNT(*)"""
+        cursor = self.walk()[1].next_cursor
+        with self.assertNumQueries(1):
+            page = CursorPaginator(Post.objects.all(), 10).get_page(
+                cursor=cursor)
+            self.assertEqual(len(page), 5)
+
+    def test_invalid_cursor_returns_first_page(self):
+        """Некорректный курсор ведет на первую страницу"""
+        page = CursorPaginator(Post.objects.all(), 10).get_page(
+            cursor='не-курсор')
+        self.assertEqual(page.number, 1)
+        self.assertEqual(page[0], self.test_posts[-1])
+
+    def test_dumped_page_loads_same_posts(self):
+        """Страница, восстановленная из кеша, совпадает с исходной"""
+        paginator = CursorPaginator(Post.objects.all(), 10)
+        page = paginator.get_page(cursor=self.walk()[0].next_cursor)
+        state = paginator.dump_page(page)
+        loaded = CursorPaginator(Post.objects.all(), 10).load_page(
+            state, Post.objects)
+        self.assertEqual(list(loaded), list(page))
+        self.assertEqual(loaded.number, 2)
+        self.assertEqual(loaded.next_cursor, page.next_cursor)
+
+
+class PageWindowTest(SimpleTestCase):
+    def window(self, number, count):
+        return page_window(Paginator(range(count), 10).page(number))
+
+    def test_window_does_not_depend_on_page_count(self):
+        """Навигация по огромной группе содержит только окно вокруг
+        текущей страницы, первую и последнюю"""
+        self.assertEqual(self.window(2500, 50000),
+                         [1, None, 2498, 2499, 2500, 2501, 2502, None, 5000])
+
+    def test_short_gaps_are_filled(self):
+        """Пропуск в одну страницу показывается номером, а не
+        многоточием"""
+        self.assertEqual(self.window(1, 50), [1, 2, 3, 4, 5])
+        self.assertEqual(self.window(5, 100),
+                         [1, 2, 3, 4, 5, 6, 7, None, 10])
@@ -0,0 +1,63 @@
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.test import Client, RequestFactory, TestCase
+from django.urls import reverse
+
+from posts.models import Group, Post
+
+User = get_user_model()
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.test_user = User.objects.create_user(username='tester')
+        cls.test_author = User.objects.create_user(username='author')
+        cls.test_group = Group.objects.create(title='Группа', slug='test',
+                                              description='Описание')
+        cls.weak = Post.objects.create(
+            text='Кошка сидит на окне, а рядом лежит книга про собак',
+            author=cls.test_user)
+        cls.strong = Post.objects.create(
+            text='Кошка и кошки: все о кошках', author=cls.test_author,
+            group=cls.test_group)
+        Post.objects.create(text='Про собак', author=cls.test_user)
+        cls.url = reverse('posts:search')
+
+    def search(self, **params):
+        return Client().get(self.url, params).context['page']
+
+    def test_results_are_ranked(self):
+        """Более релевантные посты выше, посты без совпадений не
+        попадают в выдачу"""
+        self.assertEqual(list(self.search(q='кошк')),
+                         [self.strong, self.weak])
+
+    def test_index_follows_edits_and_deletes(self):
+        """Изменение и удаление поста сразу видны в поиске"""
+        Post.objects.filter(pk=self.weak.pk).update(text='Только собаки')
+        self.assertEqual(list(self.search(q='кошка')), [self.strong])
+        Post.objects.get(pk=self.strong.pk).delete()
+        self.assertEqual(list(self.search(q='кошка')), [])
+
+    def test_filters_by_group_and_author(self):
+        """Поиск можно ограничить группой и автором"""
+        self.assertEqual(list(self.search(q='кошка', group='test')),
+                         [self.strong])
+        self.assertEqual(list(self.search(q='кошка', author='tester')),
+                         [self.weak])
+
+    def test_query_syntax_is_escaped(self):
+        """Операторы FTS5 во вводе не ломают запрос"""
+        self.assertEqual(list(self.search(q='кошка" (')),
+                         [self.strong, self.weak])
+
+    def test_admin_search_uses_index(self):
+        """Поиск в админке находит посты через тот же индекс"""
+        model_admin = admin.site._registry[Post]
+        request = RequestFactory().get('/admin/posts/post/')
+        queryset, _ = model_admin.get_search_results(
+            request, Post.objects.all(), 'собак')
+        self.assertEqual(set(queryset), set(Post.objects.exclude(
+            pk=self.strong.pk)))
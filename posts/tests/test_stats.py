@@ -0,0 +1,127 @@
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from posts import stats
+from posts.models import Follow, Group, GroupStats, Post, UserStats
+from posts.tests.test_timeline import ImmediateExecutor, run_commit_hooks
+
+User = get_user_model()
+
+
+class UserStatsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.test_user = User.objects.create_user(username='tester')
+        cls.test_author = User.objects.create_user(username='author')
+
+    def test_counters_follow_posts_and_follows(self):
+        """Счетчики меняются при создании и удалении постов и подписок"""
+        post = Post.objects.create(text='Пост', author=self.test_author)
+        follow = Follow.objects.create(user=self.test_user,
+                                       author=self.test_author)
+        author_stats = UserStats.objects.get(user=self.test_author)
+        self.assertEqual(author_stats.posts_count, 1)
+        self.assertEqual(author_stats.followers_count, 1)
+        self.assertEqual(self.test_user.stats.following_count, 1)
+        post.delete()
+        follow.delete()
+        author_stats.refresh_from_db()
+        self.assertEqual(author_stats.posts_count, 0)
+        self.assertEqual(author_stats.followers_count, 0)
+
+    def test_profile_reads_counters(self):
+        """Профиль показывает счетчики из UserStats"""
+        Post.objects.create(text='Пост', author=self.test_author)
+        Follow.objects.create(user=self.test_user, author=self.test_author)
+        response = Client().get(reverse('posts:profile',
+                                        kwargs={'username': 'author'}))
+        self.assertContains(response, 'Подписчиков: 1')
+        self.assertContains(response, 'Записей: 1')
+
+    def test_recount_stats_repairs_drift(self):
+        """Команда recount_stats исправляет разошедшиеся счетчики"""
+        Post.objects.create(text='Пост', author=self.test_author)
+        UserStats.objects.filter(user=self.test_author).update(
+            posts_count=42, followers_count=7)
+        out = StringIO()
+        call_command('recount_stats', stdout=out)
+        stats = UserStats.objects.get(user=self.test_author)
+        self.assertEqual(stats.posts_count, 1)
+        self.assertEqual(stats.followers_count, 0)
+        self.assertIn('Исправлено счетчиков: 2', out.getvalue())
+
+    def test_recount_stats_batch_size(self):
+        """recount_stats сверяет счетчики пачками размера --batch-size"""
+        UserStats.objects.update(posts_count=5)
+        out = StringIO()
+        call_command('recount_stats', '--batch-size=1', stdout=out)
+        self.assertFalse(UserStats.objects.exclude(posts_count=0).exists())
+        self.assertIn('Исправлено счетчиков: 2', out.getvalue())
+
+
+class GroupStatsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.test_author = User.objects.create_user(username='author')
+        cls.test_group = Group.objects.create(title='Группа', slug='test',
+                                              description='Описание')
+        cls.other_group = Group.objects.create(title='Другая', slug='other',
+                                               description='Описание')
+
+    def test_counter_follows_create_move_and_delete(self):
+        """Счетчик группы меняется при создании, переносе и удалении
+        поста"""
+        post = Post.objects.create(text='Пост', author=self.test_author,
+                                   group=self.test_group)
+        self.assertEqual(self.test_group.stats.posts_count, 1)
+        post.group = self.other_group
+        post.save()
+        self.assertEqual(GroupStats.objects.get(
+            group=self.test_group).posts_count, 0)
+        self.assertEqual(GroupStats.objects.get(
+            group=self.other_group).posts_count, 1)
+        post.delete()
+        self.assertEqual(GroupStats.objects.get(
+            group=self.other_group).posts_count, 0)
+
+    @override_settings(EXACT_COUNT_LIMIT=5)
+    def test_large_group_page_uses_stored_count(self):
+        """Большая группа не считает посты, а берет число из счетчика"""
+        Post.objects.bulk_create(Post(text='Пост %s' % i,
+                                      author=self.test_author,
+                                      group=self.test_group)
+                                 for i in range(3))
+        GroupStats.objects.create(group=self.test_group, posts_count=25)
+        url = reverse('posts:group', kwargs={'slug': 'test'})
+        # группа со счетчиком и посты страницы
+        with self.assertNumQueries(2):
+            response = Client().get(url)
+        self.assertEqual(response.context['page'].paginator.num_pages, 3)
+
+    @override_settings(EXACT_COUNT_LIMIT=5)
+    def test_stored_count_is_refreshed_in_background(self):
+        """Счетчик большой группы пересчитывается в фоне после просмотра,
+        но не чаще раза в STATS_REFRESH_INTERVAL"""
+        cache.clear()
+        Post.objects.bulk_create(Post(text='Пост %s' % i,
+                                      author=self.test_author,
+                                      group=self.test_group)
+                                 for i in range(7))
+        GroupStats.objects.create(group=self.test_group, posts_count=25)
+        url = reverse('posts:group', kwargs={'slug': 'test'})
+        with mock.patch('posts.stats.pool.executor', ImmediateExecutor):
+            Client().get(url)
+            run_commit_hooks()
+            self.assertEqual(GroupStats.objects.get(
+                group=self.test_group).posts_count, 7)
+        stats.refresh_group(self.test_group.pk)
+        self.assertEqual(connection.run_on_commit, [])
@@ -0,0 +1,106 @@
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from sorl.thumbnail import default
+
+from posts import thumbnails
+from posts.models import Post
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.small_gif = (
+            b'\x47\x49\x46\x38\x39\x61\x02\x00'
+            b'\x01\x00\x80\x00\x00\x00\x00\x00'
+            b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+            b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+            b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+            b'\x0A\x00\x3B'
+        )
+        cls.test_user = User.objects.create_user(username='tester')
+        cls.test_post = Post.objects.create(
+            text='Тест с картинкой',
+            author=cls.test_user,
+            image=SimpleUploadedFile(name='small.gif',
+                                     content=cls.small_gif,
+                                     content_type='image/gif'))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        default.kvstore.reset()
+
+    def test_page_shows_placeholder_until_thumbnail_exists(self):
+        """Страница не создает миниатюру сама, а показывает заглушку"""
+        url = reverse('posts:profile', kwargs={'username': 'tester'})
+        response = Client().get(url)
+        self.assertContains(response, 'Миниатюра еще создается')
+        self.assertNotContains(response, '<img class="card-img"')
+        self.assertIsNone(thumbnails.cached_thumbnail(
+            self.test_post, '960x339', crop='center', upscale=True))
+
+    def test_generated_thumbnail_replaces_placeholder(self):
+        """После фоновой генерации карточка показывает миниатюру"""
+        url = reverse('posts:profile', kwargs={'username': 'tester'})
+        Client().get(url)
+        thumbnails.generate(self.test_post.pk, self.test_post.image.name)
+        thumbnail = thumbnails.cached_thumbnail(
+            self.test_post, '960x339', crop='center', upscale=True)
+        self.assertIsNotNone(thumbnail)
+        response = Client().get(url)
+        self.assertContains(response, thumbnail.url)
+
+    def test_card_offers_widths_and_webp(self):
+        """Карточка предлагает браузеру несколько ширин и WebP"""
+        thumbnails.generate(self.test_post.pk, self.test_post.image.name)
+        picture = thumbnails.feed_picture(self.test_post)
+        self.assertEqual(picture['srcset'].count('w,'), 2)
+        self.assertIn('.jpg 480w', picture['srcset'])
+        self.assertIn('.webp 960w', picture['webp_srcset'])
+        response = Client().get(
+            reverse('posts:profile', kwargs={'username': 'tester'}))
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(response, picture['src'])
+
+    def test_prefetch_loads_page_thumbnails_in_one_query(self):
+        """Миниатюры страницы подгружаются одним запросом, а затем
+        берутся из LRU процесса"""
+        posts = [self.test_post] + [
+            Post.objects.create(
+                text='Пост %s' % i, author=self.test_user,
+                image=SimpleUploadedFile(name='small%s.gif' % i,
+                                         content=self.small_gif,
+                                         content_type='image/gif'))
+            for i in range(2)]
+        for post in posts:
+            thumbnails.generate(post.pk, post.image.name)
+        cache.clear()
+        default.kvstore.reset()
+        with self.assertNumQueries(1):
+            thumbnails.prefetch(posts)
+        with self.assertNumQueries(0):
+            for post in posts:
+                self.assertIsNotNone(thumbnails.cached_thumbnail(
+                    post, '960x339', crop='center', upscale=True))
+        stats = default.kvstore.stats()
+        # У одинаковых картинок один файл и общий набор миниатюр
+        self.assertEqual(stats['prefetched'], len(thumbnails.FEED_THUMBNAILS))
+        self.assertEqual(stats['hits'], 3)
+        self.assertEqual(stats['misses'], 0)
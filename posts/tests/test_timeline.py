@@ -0,0 +1,170 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from posts import timeline
+from posts.models import Follow, Post, Timeline
+
+User = get_user_model()
+
+
+class ImmediateExecutor:
+    def submit(self, task, *args):
+        task(*args)
+
+
+def run_commit_hooks():
+    """Выполнить отложенные on_commit: TestCase не фиксирует транзакцию."""
+    hooks, connection.run_on_commit = connection.run_on_commit, []
+    with mock.patch('posts.timeline.pool.executor', ImmediateExecutor):
+        for _, hook in hooks:
+            hook()
+
+
+class TimelineTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.test_user = User.objects.create_user(username='tester')
+        cls.test_author = User.objects.create_user(username='author')
+        cls.test_star = User.objects.create_user(username='star')
+        Follow.objects.create(user=cls.test_author, author=cls.test_star)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.test_user)
+        cache.clear()
+
+    def test_new_post_fans_out_to_followers(self):
+        """Новый пост попадает в материализованную ленту подписчика"""
+        Follow.objects.create(user=self.test_user, author=self.test_author)
+        post = Post.objects.create(text='Пост', author=self.test_author)
+        self.assertTrue(Timeline.objects.filter(user=self.test_user,
+                                                post=post).exists())
+        self.assertIn(post, timeline.follow_feed(self.test_user))
+
+    def test_follow_backfills_and_unfollow_prunes(self):
+        """Подписка добавляет в ленту старые посты, отписка их убирает"""
+        Post.objects.bulk_create(Post(text='Пост %s' % i,
+                                      author=self.test_author)
+                                 for i in range(5))
+        self.authorized_client.get(reverse(
+            'posts:profile_follow', kwargs={'username': 'author'}))
+        self.assertEqual(Timeline.objects.filter(user=self.test_user).count(),
+                         5)
+        self.authorized_client.get(reverse(
+            'posts:profile_unfollow', kwargs={'username': 'author'}))
+        self.assertFalse(Timeline.objects.filter(user=self.test_user).exists())
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_celebrity_posts_are_pulled_on_read(self):
+        """Посты автора с большим числом подписчиков не копируются
+        в ленты, но видны в ленте подписок"""
+        Follow.objects.create(user=self.test_user, author=self.test_star)
+        post = Post.objects.create(text='Пост звезды', author=self.test_star)
+        self.assertFalse(Timeline.objects.filter(post=post).exists())
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertIn(post, response.context['page'])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_feed_pages_merge_timeline_and_pulled_posts(self):
+        """Страницы ленты сливают материализованную ленту и посты,
+        подмешанные при чтении, без повторов и пропусков"""
+        Follow.objects.create(user=self.test_user, author=self.test_author)
+        Follow.objects.create(user=self.test_user, author=self.test_star)
+        posts = [Post.objects.create(
+            text='Пост %s' % i,
+            author=self.test_star if i % 3 else self.test_author)
+            for i in range(25)]
+        # Пост звезды, скопированный до того, как она стала звездой
+        Timeline.objects.create(user=self.test_user, post=posts[1],
+                                pub_date=posts[1].pub_date)
+        page = timeline.follow_page(self.test_user)
+        seen = list(page)
+        while page.has_next():
+            page = timeline.follow_page(self.test_user, page.number + 1,
+                                        page.next_cursor)
+            seen.extend(page)
+        self.assertEqual(seen, posts[::-1])
+        previous = timeline.follow_page(self.test_user, page.number - 1,
+                                        page.previous_cursor)
+        self.assertEqual(list(previous), posts[::-1][10:20])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_follow_does_not_backfill_celebrity(self):
+        """Подписка на знаменитость не копирует ее посты"""
+        Post.objects.create(text='Пост звезды', author=self.test_star)
+        Follow.objects.create(user=self.test_user, author=self.test_star)
+        self.assertFalse(Timeline.objects.filter(user=self.test_user).exists())
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_former_celebrity_posts_are_restored(self):
+        """Когда автор перестает быть знаменитостью, его посты
+        копируются подписчикам и не пропадают из ленты"""
+        Follow.objects.create(user=self.test_user, author=self.test_star)
+        post = Post.objects.create(text='Пост звезды', author=self.test_star)
+        with mock.patch('posts.timeline.transaction.on_commit') as on_commit:
+            Follow.objects.filter(user=self.test_author,
+                                  author=self.test_star).delete()
+        on_commit.assert_called_once()
+        timeline.restore(self.test_star.pk)
+        self.assertIn(post, timeline.follow_page(self.test_user))
+
+
+class FollowPageCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.test_user = User.objects.create_user(username='tester')
+        cls.test_reader = User.objects.create_user(username='reader')
+        cls.test_author = User.objects.create_user(username='author')
+        Follow.objects.create(user=cls.test_user, author=cls.test_author)
+        Post.objects.create(text='Пост автора', author=cls.test_author)
+        cls.url = reverse('posts:follow_index')
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.test_user)
+        self.reader_client = Client()
+        self.reader_client.force_login(self.test_reader)
+        cache.clear()
+
+    def test_cached_page_skips_feed_query(self):
+        """Повторный запрос ленты выбирает посты только по id"""
+        self.authorized_client.get(self.url)
+        # сессия, пользователь и посты страницы по первичному ключу
+        with self.assertNumQueries(3):
+            response = self.authorized_client.get(self.url)
+        self.assertEqual(len(response.context['page']), 1)
+
+    def test_page_cache_is_per_user(self):
+        """Закешированная лента одного пользователя не видна другому"""
+        self.authorized_client.get(self.url)
+        response = self.reader_client.get(self.url)
+        self.assertEqual(len(response.context['page']), 0)
+
+    def test_new_post_and_follow_change_feed(self):
+        """Новый пост автора и подписка сразу меняют закешированную
+        ленту"""
+        self.reader_client.get(self.url)
+        self.authorized_client.get(self.url)
+        Post.objects.create(text='Новый пост', author=self.test_author)
+        run_commit_hooks()
+        response = self.authorized_client.get(self.url)
+        self.assertEqual(len(response.context['page']), 2)
+        Follow.objects.create(user=self.test_reader, author=self.test_author)
+        response = self.reader_client.get(self.url)
+        self.assertEqual(len(response.context['page']), 2)
+
+    def test_cursor_garbage_does_not_create_entries(self):
+        """Некорректный курсор ведет на закешированную первую страницу, а
+        не создает новую запись кеша"""
+        self.authorized_client.get(self.url)
+        for cursor in ('мусор', 'abc', 'x' * 100):
+            with self.subTest(cursor=cursor):
+                with self.assertNumQueries(3):
+                    self.authorized_client.get(self.url, {'cursor': cursor})
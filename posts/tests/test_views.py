@@ -1,14 +1,23 @@
+import hashlib
 import shutil
 import tempfile
+from unittest import mock
+
 from django.conf import settings
+from django.db import OperationalError, connection
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase, override_settings
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django import forms
 from django.core.cache import caches
 
-from posts.models import Post, Group, Follow
+from posts import fallback
+from posts.caching import get_versions
+from posts.models import Post, Group, Follow, Comment
+from posts.paginator import NEXT, CursorPaginator, encode_cursor, keyset_after
 
 User = get_user_model()
 
@@ -35,6 +44,9 @@ class PostPagesTest(TestCase):
             content_type='image/gif'
 
         )
+        # Картинка хранится под хешем содержимого
+        cls.image_name = 'posts/%s.gif' % hashlib.sha256(
+            cls.small_gif).hexdigest()
         cls.test_user = User.objects.create(
             username='tester',
             email='testmail@test.com',
@@ -143,7 +155,7 @@ class PostPagesTest(TestCase):
         self.assertEqual(post_author0, 'tester')
         self.assertEqual(post_group_title0, 'Тестовая группа')
         self.assertEqual(post_group_slug0, 'test')
-        self.assertEqual(post_image, 'posts/small.gif')
+        self.assertEqual(post_image, self.image_name)
 
     def test_group_page_show_correct_context(self):
         """проверяет соответствие вывода поста
@@ -163,7 +175,7 @@ class PostPagesTest(TestCase):
         self.assertEqual(post_text, 'Тест с картинкой')
         self.assertEqual(post_author, 'tester')
         self.assertEqual(group_slug, 'test')
-        self.assertEqual(post_image, 'posts/small.gif')
+        self.assertEqual(post_image, self.image_name)
 
     def test_group_page_2_show_correct_context(self):
         """проверяет отсутствие поста в группе 2"""
@@ -187,7 +199,7 @@ class PostPagesTest(TestCase):
         author = response.context['author']
         self.assertEqual(posts.text, 'Тест с картинкой')
         self.assertEqual(author.username, 'tester')
-        self.assertEqual(posts_image, 'posts/small.gif')
+        self.assertEqual(posts_image, self.image_name)
 
     def test_username_post_id_show_correct_context(self):
         """проверяет содержимое контекста на странице поста"""
@@ -199,7 +211,7 @@ class PostPagesTest(TestCase):
         self.assertEqual(post.text, 'Тест с картинкой')
         self.assertEqual(author.username, 'tester')
         self.assertEqual(post.id, 14)
-        self.assertEqual(post_image, 'posts/small.gif')
+        self.assertEqual(post_image, self.image_name)
 
     def test_username_post_id_edit_show_correct_context(self):
         """проверяет содержимое контекста на странице поста"""
@@ -233,9 +245,12 @@ class PostPagesTest(TestCase):
         """Проверяет что кеш работает на странице index"""
         response = self.authorized_client.get(reverse('posts:index'))
         posts_first_try = response.content
-        Post.objects.create(text='еще один объект', author=self.test_user)
-        response_after_new = self.authorized_client.get(reverse('posts:index'))
-        posts_second_try = response_after_new.content
+        # update() не отправляет сигналы и не сбрасывает кеш
+        Post.objects.filter(pk=self.test_post_image.pk).update(
+            text='измененный текст')
+        response_after_update = self.authorized_client.get(
+            reverse('posts:index'))
+        posts_second_try = response_after_update.content
         self.assertEqual(posts_first_try, posts_second_try)
         caches['default'].clear()
         response_after_clear = self.authorized_client.get(reverse
@@ -243,6 +258,13 @@ class PostPagesTest(TestCase):
         posts_third_try = response_after_clear.content
         self.assertNotEqual(posts_first_try, posts_third_try)
 
+    def test_new_post_invalidates_index_cache(self):
+        """Новый пост сразу появляется на закешированной странице index"""
+        self.authorized_client.get(reverse('posts:index'))
+        Post.objects.create(text='еще один объект', author=self.test_user)
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, 'еще один объект')
+
     def test_authorized_user_can_follow_users(self):
         """Проверяет, что залогиненый пользователь может подписываться на
         дпугих пользователей"""
@@ -308,3 +330,486 @@ class PostPagesTest(TestCase):
             'posts:add_comment', kwargs={'username': 'tester',
                                          'post_id': '14'}))
         self.assertEqual(response.status_code, 302)
+
+
+class FeedQueriesTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.test_user = User.objects.create_user(username='tester')
+        cls.test_reader = User.objects.create_user(username='reader')
+        cls.test_group = Group.objects.create(title='Тестовая группа',
+                                              slug='test')
+        Follow.objects.create(user=cls.test_reader, author=cls.test_user)
+        for i in range(12):
+            post = Post.objects.create(text='Тестовый текст %s' % i,
+                                       author=cls.test_user,
+                                       group=cls.test_group)
+            for j in range(3):
+                Comment.objects.create(post=post, author=cls.test_reader,
+                                       text='Комментарий %s' % j)
+
+    def setUp(self):
+        self.guest_client = Client()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.test_reader)
+        caches['default'].clear()
+
+    def test_feed_pages_query_count(self):
+        """Число запросов ленты не зависит от комментариев, авторов
+        и групп постов"""
+        feeds = {
+            reverse('posts:index'): (self.guest_client, 1),
+            reverse('posts:group', kwargs={'slug': 'test'}): (
+                self.guest_client, 3),
+            reverse('posts:profile', kwargs={'username': 'tester'}): (
+                self.guest_client, 3),
+            # ключи страницы по индексу ленты, затем посты по id
+            reverse('posts:follow_index'): (self.authorized_client, 5),
+        }
+        for url, (client, queries) in feeds.items():
+            with self.subTest(url=url):
+                with self.assertNumQueries(queries):
+                    response = client.get(url)
+                self.assertContains(response, 'Комментариев: 3')
+
+    def test_index_feed_is_not_grouped(self):
+        """Комментарии считаются подзапросом: главная не группирует и не
+        сортирует все посты до LIMIT страницы"""
+        paginator = CursorPaginator(Post.feed.all(), 10)
+        for queryset in (
+                paginator.object_list,
+                paginator.object_list.filter(keyset_after(
+                    *Post.objects.values_list('pub_date', 'pk').last()))):
+            plan = queryset[:11].explain()
+            with self.subTest(plan=plan):
+                self.assertNotIn('GROUP BY', plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_feeds_are_not_grouped(self):
+        """Ни одна лента не группирует посты ради числа комментариев"""
+        querysets = {
+            'group': Post.feed.filter(group=self.test_group),
+            'profile': Post.feed.filter(author=self.test_user),
+            'follow': Post.feed.filter(
+                pk__in=Post.objects.values_list('pk', flat=True)[:10]),
+        }
+        for name, queryset in querysets.items():
+            with self.subTest(feed=name):
+                self.assertNotIn('GROUP BY', queryset[:11].explain())
+                # Страница из кеша подгружает посты по id через in_bulk
+                self.assertEqual(
+                    queryset.in_bulk()[queryset.first().pk].comment_count,
+                    3)
+
+    def test_feed_defers_unused_author_columns(self):
+        """Лента не выбирает хеш пароля и last_login автора"""
+        post = Post.feed.first()
+        deferred = post.author.get_deferred_fields()
+        self.assertIn('password', deferred)
+        self.assertIn('last_login', deferred)
+        with self.assertNumQueries(0):
+            self.assertEqual(post.author.username, 'tester')
+            self.assertEqual(post.group.slug, 'test')
+
+
+class PostCardCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.test_user = User.objects.create_user(username='tester')
+        cls.test_group = Group.objects.create(title='Тестовая группа',
+                                              slug='test')
+        cls.test_post = Post.objects.create(text='Тестовый текст',
+                                            author=cls.test_user,
+                                            group=cls.test_group)
+        cls.group_url = reverse('posts:group', kwargs={'slug': 'test'})
+
+    def setUp(self):
+        self.guest_client = Client()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.test_user)
+        caches['default'].clear()
+
+    def test_cached_cards_are_not_rendered_again(self):
+        """Повторный показ ленты берет карточки из кеша"""
+        response = self.guest_client.get(self.group_url)
+        self.assertTemplateUsed(response, 'posts/post_item.html')
+        response = self.guest_client.get(self.group_url)
+        self.assertTemplateNotUsed(response, 'posts/post_item.html')
+        self.assertContains(response, 'Тестовый текст')
+
+    def test_post_edit_and_comment_refresh_card(self):
+        """Редактирование поста и новый комментарий обновляют карточку"""
+        self.guest_client.get(self.group_url)
+        kwargs = {'username': 'tester', 'post_id': self.test_post.pk}
+        self.authorized_client.post(
+            reverse('posts:post_edit', kwargs=kwargs),
+            data={'text': 'Новый текст', 'group': self.test_group.pk})
+        self.authorized_client.post(
+            reverse('posts:add_comment', kwargs=kwargs),
+            data={'text': 'Комментарий'})
+        response = self.guest_client.get(self.group_url)
+        self.assertContains(response, 'Новый текст')
+        self.assertContains(response, 'Комментариев: 1')
+
+    def test_group_change_refreshes_card(self):
+        """Изменение группы обновляет карточки ее постов"""
+        self.guest_client.get(self.group_url)
+        self.test_group.title = 'Новое название'
+        self.test_group.save()
+        response = self.guest_client.get(self.group_url)
+        self.assertContains(response, '#Новое название')
+
+    def test_rename_refreshes_card(self):
+        """Новое имя автора обновляет карточки его постов"""
+        self.guest_client.get(self.group_url)
+        author = User.objects.get(pk=self.test_user.pk)
+        author.username = 'renamed'
+        author.save()
+        response = self.guest_client.get(self.group_url)
+        self.assertContains(response, 'renamed')
+
+    def test_signup_and_password_change_keep_versions(self):
+        """Регистрация и смена пароля не сбрасывают общие версии"""
+        versions = get_versions('index', 'names')
+        user = User.objects.create_user(username='newcomer')
+        user.set_password('secret')
+        user.save()
+        self.assertEqual(get_versions('index', 'names'), versions)
+
+    def test_index_cache_is_shared_between_users(self):
+        """Кеш index общий для всех, кнопка редактирования видна только
+        автору поста"""
+        reader_client = Client()
+        reader_client.force_login(User.objects.create_user(username='reader'))
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, 'Редактировать')
+        Post.objects.filter(pk=self.test_post.pk).update(text='Новый текст')
+        for client in (reader_client, self.guest_client):
+            with self.subTest(client=client):
+                response = client.get(reverse('posts:index'))
+                self.assertContains(response, 'Тестовый текст')
+                self.assertNotContains(response, 'Редактировать')
+                self.assertNotContains(response, 'post-edit')
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.test_user = User.objects.create_user(username='tester')
+        cls.test_author = User.objects.create_user(username='author')
+        cls.test_post = Post.objects.create(text='Пост',
+                                            author=cls.test_author)
+
+    def setUp(self):
+        caches['default'].clear()
+        self.guest_client = Client()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.test_user)
+
+    def revalidate(self, client, url):
+        etag = client.get(url)['ETag']
+        return client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_page_is_not_modified(self):
+        """Неизменившаяся страница отдается как 304 без запросов к базе"""
+        url = reverse('posts:index')
+        etag = self.guest_client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_new_post_changes_feed_etag(self):
+        """Новый пост меняет ETag ленты"""
+        url = reverse('posts:index')
+        etag = self.guest_client.get(url)['ETag']
+        Post.objects.create(text='Новый пост', author=self.test_author)
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_follow_changes_profile_etag(self):
+        """Подписка меняет счетчик и кнопку в профиле, а значит и ETag"""
+        url = reverse('posts:profile', kwargs={'username': 'author'})
+        etag = self.authorized_client.get(url)['ETag']
+        self.authorized_client.get(reverse(
+            'posts:profile_follow', kwargs={'username': 'author'}))
+        response = self.authorized_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.revalidate(self.authorized_client,
+                                         url).status_code, 304)
+
+    def test_comment_changes_post_etag(self):
+        """Комментарий меняет ETag страницы поста"""
+        url = reverse('posts:post', kwargs={'username': 'author',
+                                            'post_id': self.test_post.pk})
+        etag = self.guest_client.get(url)['ETag']
+        Comment.objects.create(post=self.test_post, author=self.test_user,
+                               text='Комментарий')
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_depends_on_user(self):
+        """Страница гостя не подходит вошедшему пользователю"""
+        url = reverse('posts:index')
+        etag = self.guest_client.get(url)['ETag']
+        response = self.authorized_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class AnonymousPageCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.test_user = User.objects.create_user(username='tester')
+        cls.test_author = User.objects.create_user(username='author')
+        cls.test_group = Group.objects.create(title='Группа', slug='group')
+        cls.test_post = Post.objects.create(
+            text='Пост', author=cls.test_author, group=cls.test_group)
+
+    def setUp(self):
+        caches['default'].clear()
+        self.guest_client = Client()
+        self.urls = [
+            reverse('posts:index'),
+            reverse('posts:group', kwargs={'slug': 'group'}),
+            reverse('posts:profile', kwargs={'username': 'author'}),
+        ]
+
+    def test_repeated_page_is_served_from_cache(self):
+        """Повторная страница гостя отдается без запросов к базе"""
+        for url in self.urls:
+            with self.subTest(url=url):
+                first = self.guest_client.get(url)
+                with self.assertNumQueries(0):
+                    response = self.guest_client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, first.content)
+
+    def test_cached_page_is_public(self):
+        """Страница гостя не зависит от cookie и может храниться в прокси"""
+        response = self.guest_client.get(self.urls[0])
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+        self.assertIn('public', response['Cache-Control'])
+        # Браузер проверяет страницу каждый раз и после входа не покажет
+        # страницу гостя
+        self.assertIn('max-age=0', response['Cache-Control'])
+        self.assertIn('s-maxage=%s' % settings.PAGE_CACHE_MAX_AGE,
+                      response['Cache-Control'])
+
+    def test_unknown_params_share_cached_page(self):
+        """Параметры, которые страница не читает, не входят в ключ"""
+        url = self.urls[1]
+        self.guest_client.get(url, {'page': '1'})
+        with self.assertNumQueries(0):
+            response = self.guest_client.get(
+                url, {'page': '1', 'utm_source': 'mail', 'cursor': 'x'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_page_below_one_does_not_replace_first_page(self):
+        """Номер меньше единицы ведет на последнюю страницу и кешируется
+        отдельно от первой"""
+        url = self.urls[1]
+        Post.objects.bulk_create(Post(text='Пост %s' % i,
+                                      author=self.test_author,
+                                      group=self.test_group)
+                                 for i in range(10))
+        self.assertEqual(self.guest_client.get(url, {'page': '0'})
+                         .context['page'].number, 2)
+        response = self.guest_client.get(url)
+        self.assertEqual(response.context['page'].number, 1)
+
+    def test_new_post_purges_pages(self):
+        """Новый пост в группе сбрасывает главную, группу и профиль"""
+        for url in self.urls:
+            self.guest_client.get(url)
+        Post.objects.create(text='Свежий пост', author=self.test_author,
+                            group=self.test_group)
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.assertContains(self.guest_client.get(url), 'Свежий пост')
+
+    def test_comment_purges_pages(self):
+        """Комментарий меняет счетчик на карточках и сбрасывает страницы"""
+        for url in self.urls:
+            self.guest_client.get(url)
+        Comment.objects.create(post=self.test_post, author=self.test_user,
+                               text='Комментарий')
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.assertNotEqual(
+                    self.guest_client.get(url).context, None)
+
+    def test_follow_purges_profile(self):
+        """Подписка меняет счетчик подписчиков в профиле"""
+        url = self.urls[2]
+        self.guest_client.get(url)
+        Follow.objects.create(user=self.test_user, author=self.test_author)
+        response = self.guest_client.get(url)
+        self.assertEqual(response.context['author'].stats.followers_count, 1)
+
+    def test_session_bypasses_cache(self):
+        """Запрос с сессией не получает страницу гостя"""
+        url = self.urls[0]
+        self.guest_client.get(url)
+        client = Client()
+        client.force_login(self.test_user)
+        response = client.get(url)
+        self.assertIsNotNone(response.context)
+        self.assertIn('Cookie', response.get('Vary', ''))
+
+
+class StaleIfErrorTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.test_user = User.objects.create_user(username='tester')
+        cls.test_group = Group.objects.create(title='Группа', slug='group')
+        Post.objects.create(text='Пост', author=cls.test_user,
+                            group=cls.test_group)
+
+    def setUp(self):
+        caches['default'].clear()
+        caches['stale'].clear()
+        self.guest_client = Client()
+        self.urls = [reverse('posts:index'),
+                     reverse('posts:group', kwargs={'slug': 'group'})]
+
+    def broken(self, client, url, **params):
+        """Запрос, в котором база недоступна"""
+        with mock.patch('posts.views.render',
+                        side_effect=OperationalError('locked')) as render:
+            response = client.get(url, params)
+        self.render_calls = render.call_count
+        return response
+
+    def test_stale_copy_is_served_on_error(self):
+        """При ошибке базы гость получает последнюю удачную копию
+        страницы, а страница перестраивается в фоне"""
+        for url in self.urls:
+            with self.subTest(url=url):
+                good = self.guest_client.get(url)
+                # Иначе страницу отдаст кеш страниц гостей
+                caches['default'].clear()
+                with mock.patch('posts.fallback.pool') as pool, \
+                        self.assertLogs('posts.fallback', 'WARNING'):
+                    response = self.broken(self.guest_client, url, utm='x')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, good.content)
+                self.assertEqual(response['Warning'], fallback.STALE_WARNING)
+                self.assertIn('no-cache', response['Cache-Control'])
+                pool.submit.assert_called_once()
+
+    def test_copy_is_served_at_once_while_refreshing(self):
+        """Пока страница перестраивается, копия отдается без обращения к
+        базе, а второе построение не запускается"""
+        url = self.urls[0]
+        self.guest_client.get(url)
+        caches['default'].clear()
+        with mock.patch('posts.fallback.pool') as pool:
+            with self.assertLogs('posts.fallback', 'WARNING'):
+                self.broken(self.guest_client, url)
+            response = self.broken(self.guest_client, url)
+        self.assertEqual(self.render_calls, 0)
+        self.assertEqual(response['Warning'], fallback.STALE_WARNING)
+        pool.submit.assert_called_once()
+
+    def test_error_without_copy_is_raised(self):
+        """Без копии ошибка не скрывается"""
+        with self.assertRaises(OperationalError):
+            self.broken(self.guest_client, self.urls[0])
+
+    def test_users_get_guest_copy_on_error(self):
+        """Вошедший пользователь при ошибке получает копию страницы гостя,
+        но его страницы копиями не становятся"""
+        client = Client()
+        client.force_login(self.test_user)
+        client.get(self.urls[1])
+        with self.assertRaises(OperationalError):
+            self.broken(client, self.urls[1])
+        good = self.guest_client.get(self.urls[1])
+        # Прежний клиент хранит исключение: страница 500 тоже вызывает
+        # подмененный render
+        client = Client()
+        client.force_login(self.test_user)
+        with mock.patch('posts.fallback.pool'), \
+                self.assertLogs('posts.fallback', 'WARNING'):
+            response = self.broken(client, self.urls[1])
+        self.assertEqual(response.content, good.content)
+
+    def test_refresh_uses_fresh_guest_request(self):
+        """Фоновое построение получает новый запрос гостя только с
+        параметрами страницы"""
+        request = RequestFactory().get(self.urls[0], {'page': '2', 'x': '1'},
+                                       HTTP_IF_NONE_MATCH='"etag"')
+        request.user = self.test_user
+        fresh = fallback.guest_request(request)
+        self.assertFalse(fresh.user.is_authenticated)
+        self.assertEqual(dict(fresh.GET), {'page': ['2']})
+        self.assertNotIn('HTTP_IF_NONE_MATCH', fresh.META)
+        self.assertEqual(fresh.path, self.urls[0])
+
+    @override_settings(STALE_REFRESH_DELAY=0)
+    def test_refresh_retries(self):
+        """Фоновое обновление повторяет запрос, сохраняет новую копию и
+        снимает блокировку"""
+        key = 'stale-copy:test'
+        caches['stale'].add('stale-refresh:%s' % key, 1)
+        request = fallback.guest_request(RequestFactory().get(self.urls[0]))
+        view = mock.Mock(side_effect=[OperationalError('locked'),
+                                      HttpResponse('новая копия')])
+        with self.assertLogs('posts.fallback', 'WARNING'):
+            fallback.refresh(view, request, (), {}, key)
+        self.assertEqual(view.call_count, 2)
+        self.assertEqual(caches['stale'].get(key).content,
+                         'новая копия'.encode())
+        self.assertIsNone(caches['stale'].get('stale-refresh:%s' % key))
+
+    def test_latency_budget_interrupts_query(self):
+        """Запрос дольше бюджета прерывается"""
+        budget = fallback.LatencyBudget(1e-9)
+        with self.assertRaises(OperationalError), budget:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL '
+                    'SELECT x + 1 FROM c WHERE x < 1000000) '
+                    'SELECT count(*) FROM c')
+        self.assertTrue(budget.exceeded)
+
+
+class IndexFragmentCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.test_user = User.objects.create_user(username='tester')
+        for i in range(25):
+            Post.objects.create(text='Пост P%02d' % i, author=cls.test_user)
+
+    def setUp(self):
+        caches['default'].clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.test_user)
+
+    def test_forged_cursor_does_not_replace_page(self):
+        """Курсор с номером страницы, который не соответствует позиции,
+        не подменяет эту страницу в общем кеше"""
+        url = reverse('posts:index')
+        posts = list(Post.objects.order_by('-pub_date', '-pk'))
+        self.authorized_client.get(url, {
+            'cursor': encode_cursor(2, NEXT, posts[20])})
+        first = self.authorized_client.get(url)
+        response = self.authorized_client.get(url, {
+            'cursor': first.context['page'].next_cursor})
+        self.assertContains(response, 'P14')
+        self.assertNotContains(response, 'P03')
+
+    def test_cached_fragment_skips_feed_query(self):
+        """При попадании в кеш фрагмента лента не запрашивается"""
+        url = reverse('posts:index')
+        self.authorized_client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.authorized_client.get(url)
+        self.assertContains(response, 'P24')
+        self.assertFalse([query for query in queries
+                          if 'posts_post' in query['sql']])
@@ -0,0 +1,169 @@
+"""Миниатюры картинок постов.
+
+sorl-thumbnail создает миниатюру при первом показе страницы, и первый
+посетитель после публикации ждет декодирования и сжатия полноразмерной
+картинки. Здесь миниатюры создаются в пуле потоков сразу после сохранения
+поста, а шаблоны только ищут готовую миниатюру и до ее появления
+показывают заглушку.
+"""
+import logging
+import threading
+from functools import partial
+
+from django.db import transaction
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix
+
+from posts.background import Pool
+from posts.caching import bump, bump_post_pages
+from posts.models import Post
+
+logger = logging.getLogger(__name__)
+
+# Ширины миниатюры карточки для srcset; пропорции у всех одинаковые
+FEED_SIZES = ('480x170', '720x254', '960x339')
+FEED_OPTIONS = {'crop': 'center', 'upscale': True}
+# Миниатюры, которые показывают шаблоны: (геометрия, параметры). Каждая
+# ширина создается в формате исходной картинки и в WebP
+FEED_THUMBNAILS = tuple(
+    (geometry, dict(FEED_OPTIONS, **extra))
+    for extra in ({}, {'format': 'WEBP'})
+    for geometry in FEED_SIZES)
+# Значение sizes для srcset: карточка занимает колонку шириной до 960px
+FEED_IMAGE_SIZES = '(max-width: 960px) 100vw, 960px'
+
+pool = Pool('thumbnails', 'THUMBNAIL_WORKERS')
+_pending = set()
+_lock = threading.Lock()
+
+
+class LookupBackend(ThumbnailBackend):
+    def thumbnail_file(self, file_, geometry_string, **options):
+        """Файл миниатюры, еще не обязательно созданной.
+
+        Параметры дополняются так же, как в ``get_thumbnail``, чтобы имя
+        миниатюры совпало с именем, под которым ее сохранит sorl.
+        """
+        source = ImageFile(file_)
+        if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(sorl_settings, attr)
+            if value != getattr(sorl_defaults, attr):
+                options.setdefault(key, value)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return ImageFile(name, default.storage)
+
+    def get_cached_thumbnail(self, file_, geometry_string, **options):
+        """Готовая миниатюра из KVStore или None; ничего не создает."""
+        return default.kvstore.get(
+            self.thumbnail_file(file_, geometry_string, **options))
+
+
+backend = LookupBackend()
+
+
+def generate(post_id, name):
+    try:
+        source = ImageFile(name, Post.image.field.storage)
+        if not source.exists():
+            return
+        created = False
+        for geometry, options in FEED_THUMBNAILS:
+            if backend.get_cached_thumbnail(source, geometry, **options):
+                continue
+            try:
+                get_thumbnail(source, geometry, **options)
+                created = True
+            except Exception:
+                logger.exception('Не удалось создать миниатюру %s %s %s',
+                                 name, geometry, options)
+        if created:
+            # Карточка с заглушкой уже могла попасть в кеш, как и страница
+            # анонимного посетителя
+            bump('post:%s' % post_id)
+            bump_post_pages(post_id)
+    finally:
+        with _lock:
+            _pending.discard(name)
+
+
+def submit(post_id, name):
+    with _lock:
+        if name in _pending:
+            return
+        _pending.add(name)
+    pool.submit(generate, post_id, name)
+
+
+def schedule(post):
+    """Создать миниатюры картинки поста в фоне после фиксации транзакции.
+
+    Картинка, которая уже в очереди, повторно не ставится.
+    """
+    if post.image:
+        transaction.on_commit(partial(submit, post.pk, post.image.name))
+
+
+def prefetch(posts):
+    """Подгрузить записи миниатюр картинок постов одним запросом.
+
+    Работает, если в ``THUMBNAIL_KVSTORE`` указано хранилище с методом
+    ``prefetch``, например ``posts.kvstore.PrefetchingKVStore``.
+    """
+    if not hasattr(default.kvstore, 'prefetch'):
+        return
+    keys = [add_prefix(backend.thumbnail_file(post.image, geometry,
+                                              **options).key)
+            for post in posts if post.image
+            for geometry, options in FEED_THUMBNAILS]
+    default.kvstore.prefetch(keys)
+
+
+def cached_thumbnail(post, geometry, **options):
+    """Готовая миниатюра картинки поста или None.
+
+    Если миниатюры нет, например для картинки, загруженной до появления
+    фоновой генерации, она ставится в очередь.
+    """
+    if not post.image:
+        return None
+    thumbnail = backend.get_cached_thumbnail(post.image, geometry, **options)
+    if thumbnail is None:
+        schedule(post)
+    return thumbnail
+
+
+def feed_picture(post):
+    """Готовые варианты миниатюры карточки поста для ``<picture>``.
+
+    Возвращает None, пока нет ни одной миниатюры в формате исходной
+    картинки. Отсутствующие варианты ставятся в очередь и появляются в
+    srcset после создания.
+    """
+    if not post.image:
+        return None
+    srcsets = {}
+    for geometry, options in FEED_THUMBNAILS:
+        thumbnail = cached_thumbnail(post, geometry, **options)
+        if thumbnail is not None:
+            srcsets.setdefault(options.get('format'), []).append(
+                (thumbnail.width, thumbnail.url))
+    if None not in srcsets:
+        return None
+
+    def srcset(variants):
+        return ', '.join('%s %sw' % (url, width) for width, url in variants)
+
+    return {
+        'src': max(srcsets[None])[1],
+        'srcset': srcset(srcsets[None]),
+        'webp_srcset': srcset(srcsets.get('WEBP', ())),
+        'sizes': FEED_IMAGE_SIZES,
+    }
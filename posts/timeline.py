@@ -0,0 +1,236 @@
+"""Материализованная лента подписок (fan-out on write).
+
+Новый пост копируется в ленты подписчиков автора при публикации, поэтому
+чтение ленты не требует соединения с таблицей подписок. Посты авторов с
+очень большим числом подписчиков не копируются: они подмешиваются в ленту
+при чтении, чтобы один пост не порождал миллионы строк.
+
+Когда автор перестает быть знаменитостью, его последние посты копируются
+подписчикам в фоне (``restore``): при публикации они не копировались, а
+подмешиваться при чтении перестают.
+
+Страницы ленты кешируются для каждого пользователя под версией
+``feed:<id>``, которая меняется после доставки нового поста в ленту и при
+подписке или отписке, и версиями ``posts-by:<id>`` авторов, чьи посты
+подмешиваются при чтении.
+"""
+import heapq
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from posts.background import Pool
+from posts.caching import bump, get_versions, remember
+from posts.models import Follow, Post, Timeline, UserStats
+from posts.paginator import (CursorPaginator, keyset_after, keyset_before,
+                             position_key)
+from posts.utils import batches
+
+pool = Pool('timeline')
+
+
+def is_celebrity(author_id):
+    return UserStats.objects.filter(
+        user_id=author_id,
+        followers_count__gt=settings.TIMELINE_FANOUT_LIMIT).exists()
+
+
+def celebrities(user):
+    """id авторов из подписок пользователя, чьи посты не копируются."""
+    return list(Follow.objects.filter(
+        user=user,
+        author__stats__followers_count__gt=settings.TIMELINE_FANOUT_LIMIT)
+        .values_list('author', flat=True))
+
+
+def fan_out(post):
+    if is_celebrity(post.author_id):
+        return
+    size = settings.TIMELINE_BATCH_SIZE
+    followers = (Follow.objects.filter(author_id=post.author_id)
+                 .values_list('user_id', flat=True)
+                 .iterator(chunk_size=size))
+    delivered = []
+    for batch in batches(followers, size):
+        Timeline.objects.bulk_create(
+            [Timeline(user_id=user_id, post=post, pub_date=post.pub_date)
+             for user_id in batch],
+            ignore_conflicts=True)
+        delivered.extend(batch)
+    if delivered:
+        # Версии лент сбрасываются в фоне: до фиксации новый пост все
+        # равно не виден, а тысячи обращений к кешу не задерживают запрос
+        transaction.on_commit(partial(pool.submit, bump_feeds, delivered))
+
+
+def bump_feeds(user_ids):
+    """Сбросить закешированные ленты пользователей пачками."""
+    for batch in batches(user_ids, settings.TIMELINE_BATCH_SIZE):
+        bump(*('feed:%s' % user_id for user_id in batch))
+
+
+def backfill(user_id, author_id):
+    if is_celebrity(author_id):
+        # Посты знаменитости подмешиваются при чтении
+        return
+    size = settings.TIMELINE_BATCH_SIZE
+    posts = (Post.objects.filter(author_id=author_id).order_by()
+             .values_list('pk', 'pub_date').iterator(chunk_size=size))
+    for batch in batches(posts, size):
+        Timeline.objects.bulk_create(
+            [Timeline(user_id=user_id, post_id=post_id, pub_date=pub_date)
+             for post_id, pub_date in batch],
+            ignore_conflicts=True)
+
+
+def followers_changed(author_id):
+    """Проверить после подписки или отписки, не пересек ли автор порог
+    ``TIMELINE_FANOUT_LIMIT``.
+
+    Закешированные списки подмешиваемых авторов у подписчиков при этом
+    устаревают, а при переходе вниз последние посты автора копируются в
+    их ленты. И то и другое делается в фоне после фиксации транзакции.
+    """
+    followers = (UserStats.objects.filter(user_id=author_id)
+                 .values_list('followers_count', flat=True).first())
+    limit = settings.TIMELINE_FANOUT_LIMIT
+    if followers == limit:
+        task = partial(restore, author_id)
+    elif followers == limit + 1:
+        task = partial(bump_followers, author_id)
+    else:
+        return
+    transaction.on_commit(partial(pool.submit, task))
+
+
+def restore(author_id):
+    """Скопировать подписчикам последние ``TIMELINE_RESTORE_LIMIT`` постов
+    автора, которые подмешивались при чтении."""
+    size = settings.TIMELINE_BATCH_SIZE
+    posts = list(Post.objects.filter(author_id=author_id)
+                 .order_by('-pub_date')
+                 .values_list('pk', 'pub_date')
+                 [:settings.TIMELINE_RESTORE_LIMIT])
+    if not posts:
+        return
+    followers = (Follow.objects.filter(author_id=author_id)
+                 .values_list('user_id', flat=True)
+                 .iterator(chunk_size=size))
+    for batch in batches(followers, max(size // len(posts), 1)):
+        Timeline.objects.bulk_create(
+            [Timeline(user_id=user_id, post_id=post_id,
+                      pub_date=pub_date)
+             for user_id in batch for post_id, pub_date in posts],
+            batch_size=size, ignore_conflicts=True)
+        bump_feeds(batch)
+
+
+def bump_followers(author_id):
+    """Сбросить ленты подписчиков автора."""
+    followers = (Follow.objects.filter(author_id=author_id)
+                 .values_list('user_id', flat=True)
+                 .iterator(chunk_size=settings.TIMELINE_BATCH_SIZE))
+    bump_feeds(followers)
+
+
+def prune(user_id, author_id):
+    size = settings.TIMELINE_BATCH_SIZE
+    entries = Timeline.objects.filter(user_id=user_id,
+                                      post__author_id=author_id)
+    batch = list(entries.values_list('pk', flat=True)[:size])
+    while batch:
+        Timeline.objects.filter(pk__in=batch).delete()
+        batch = list(entries.values_list('pk', flat=True)[:size])
+
+
+def follow_feed(user, pulled=()):
+    """Лента подписок пользователя для ``Post.feed``.
+
+    Страницы выбирает ``FollowFeedPaginator``, а этот запрос нужен только
+    для подсчета записей.
+    """
+    posts = Q(pk__in=Timeline.objects.filter(user=user).values('post_id'))
+    if pulled:
+        posts |= Q(author__in=pulled)
+    return Post.feed.filter(posts)
+
+
+class FollowFeedPaginator(CursorPaginator):
+    """Страницы ленты подписок из двух источников.
+
+    Материализованная лента читается по индексу (user, -pub_date), посты
+    авторов, которые подмешиваются при чтении, — по дате публикации. Из
+    каждого источника берется не больше нужного числа ключей, ключи
+    сливаются по порядку ленты, а посты выбираются по первичному ключу.
+    """
+
+    def __init__(self, user, pulled, per_page):
+        super().__init__(follow_feed(user, pulled), per_page)
+        self.user = user
+        self.pulled = pulled
+
+    def sources(self):
+        yield (Timeline.objects.filter(user=self.user)
+               .values_list('pub_date', 'post_id'), 'post_id')
+        if self.pulled:
+            yield (Post.objects.filter(author__in=self.pulled)
+                   .values_list('pub_date', 'pk'), 'pk')
+
+    def fetch(self, limit, offset=0, after=None, before=None):
+        stop = offset + limit
+        keys = []
+        for queryset, field in self.sources():
+            if before is not None:
+                queryset = (queryset.filter(keyset_before(*before, field))
+                            .order_by('pub_date', field))
+            else:
+                if after is not None:
+                    queryset = queryset.filter(keyset_after(*after, field))
+                queryset = queryset.order_by('-pub_date', '-' + field)
+            keys.append(list(queryset[:stop]))
+        # Пост автора, который стал подмешиваться, может быть и в
+        # материализованной ленте
+        seen = set()
+        merged = []
+        for pub_date, pk in heapq.merge(*keys, reverse=before is None):
+            if pk not in seen:
+                seen.add(pk)
+                merged.append(pk)
+        merged = merged[offset:stop]
+        if before is not None:
+            merged.reverse()
+        posts = Post.feed.in_bulk(merged)
+        return [posts[pk] for pk in merged if pk in posts]
+
+
+def follow_page(user, number=None, cursor=None):
+    """Страница ленты подписок.
+
+    В кеше хранятся только id постов страницы: при попадании сами посты
+    выбираются по первичному ключу, а тяжелый запрос к ленте не нужен.
+    Карточки постов кешируются отдельно и не устаревают при правках.
+    Одновременные промахи строят страницу один раз (см. ``remember``).
+    """
+    timeout = settings.FOLLOW_CACHE_TIMEOUT
+    feed = 'feed:%s' % user.pk
+    version = get_versions(feed)[feed]
+    pulled = remember('follow-celebrities:%s' % user.pk,
+                      partial(celebrities, user), timeout, version)
+    names = ['posts-by:%s' % author_id for author_id in pulled]
+    versions = get_versions(*names)
+    page_version = '%s:%s' % (
+        version, '.'.join(str(versions[name]) for name in names))
+    paginator = FollowFeedPaginator(user, pulled, 10)
+    built = []
+
+    def build():
+        built.append(paginator.get_page(number, cursor))
+        return paginator.dump_page(built[0])
+
+    key = 'follow-page:%s:%s' % (user.pk, position_key(number, cursor))
+    state = remember(key, build, timeout, page_version)
+    if built:
+        return built[0]
+    return paginator.load_page(state, Post.feed)
@@ -0,0 +1,11 @@
+"""Вспомогательные функции без зависимостей от моделей."""
+from itertools import islice
+
+
+def batches(iterable, size):
+    """Разбить ``iterable`` на списки не длиннее ``size``."""
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
@@ -1,31 +1,101 @@
+import hmac
+from functools import partial
+
 from django.shortcuts import render, get_object_or_404, redirect
+from django.conf import settings
 from django.core.paginator import Paginator
 from django.contrib.auth.decorators import login_required
-from posts.models import Post, Group, Follow
+from posts.models import Post, Group, Follow, GroupStats, UserStats
 from posts.forms import PostForm, CommentForm
+from posts.paginator import (CursorPaginator, StoredCountPaginator,
+                             position_key)
+from posts import metrics, search, timeline
+from posts.stats import recount, recount_group, refresh, refresh_group
+from posts.caching import get_versions, page_etag
+from posts.fallback import stale_if_error
 from django.contrib.auth import get_user_model
+from django.http import Http404, HttpResponse
 from django.urls import reverse
+from django.utils.functional import SimpleLazyObject
+from django.views.decorators.http import condition
 
 User = get_user_model()
 
 
-def index(request):
-    latest = Post.objects.all()
-    paginator = Paginator(latest, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return render(request, 'posts/index.html', {'page': page})
+def feed_etag(request, *args, **kwargs):
+    # Версия index меняется при любом изменении карточек постов
+    return page_etag(request, 'index')
+
+
+def profile_etag(request, username):
+    names = ['index', 'profile:%s' % username]
+    if request.user.is_authenticated:
+        # Кнопка подписки зависит от подписок посетителя
+        names.append('feed:%s' % request.user.pk)
+    return page_etag(request, *names)
+
+
+def post_etag(request, username, post_id):
+    return page_etag(request, 'post:%s' % post_id, 'names')
 
 
+@stale_if_error
+@condition(etag_func=feed_etag)
+def index(request):
+    latest = Post.feed.all()
+    paginator = CursorPaginator(latest, 10)
+    page_number = request.GET.get('page')
+    cursor = request.GET.get('cursor')
+    # Лента выбирается только при промахе кеша фрагмента в шаблоне
+    page = SimpleLazyObject(partial(paginator.get_page, page_number, cursor))
+    return render(request, 'posts/index.html', {
+        'page': page,
+        'position': position_key(page_number, cursor),
+        'index_version': get_versions('index')['index'],
+        'index_timeout': settings.INDEX_CACHE_TIMEOUT,
+    })
+
+
+@stale_if_error
+@condition(etag_func=feed_etag)
 def group_posts(request, slug):
-    group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
-    paginator = Paginator(posts, 10)
+    group = get_object_or_404(Group.objects.select_related('stats'),
+                              slug=slug)
+    try:
+        stats = group.stats
+    except GroupStats.DoesNotExist:
+        stats = recount_group(group.pk)
+    posts = Post.feed.filter(group=group)
+    paginator = StoredCountPaginator(posts, 10, stats.posts_count,
+                                     partial(refresh_group, group.pk))
     page_number = request.GET.get('page')
     page = paginator.get_page(page_number)
     return render(request, 'posts/group.html', {'group': group, 'page': page})
 
 
+def search_posts(request):
+    query = request.GET.get('q', '').strip()
+    group = request.GET.get('group', '')
+    author = request.GET.get('author', '').strip()
+    posts = Post.feed.all()
+    if group:
+        posts = posts.filter(group__slug=group)
+    if author:
+        posts = posts.filter(author__username=author)
+    paginator = Paginator(search.search(posts, query), 10)
+    page = paginator.get_page(request.GET.get('page'))
+    params = request.GET.copy()
+    params.pop('page', None)
+    return render(request, 'posts/search.html', {
+        'page': page,
+        'query': query,
+        'group': group,
+        'author': author,
+        'groups': Group.objects.order_by('title'),
+        'query_string': params.urlencode(),
+    })
+
+
 @login_required
 def new_post(request):
     form = PostForm(request.POST or None, files=request.FILES or None)
@@ -51,25 +121,30 @@ def add_comment(request, username, post_id):
     return redirect(reverse('posts:post', kwargs=reverse_kwargs))
 
 
+@condition(etag_func=profile_etag)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    posts_by_author = author.posts.filter(author=author)
-    paginator = Paginator(posts_by_author, 10)
+    author = get_object_or_404(User.objects.select_related('stats'),
+                               username=username)
+    try:
+        stats = author.stats
+    except UserStats.DoesNotExist:
+        stats = recount(author.pk)
+    posts_by_author = Post.feed.filter(author=author)
+    paginator = StoredCountPaginator(posts_by_author, 10, stats.posts_count,
+                                     partial(refresh, author.pk))
     page_number = request.GET.get('page')
     page = paginator.get_page(page_number)
+    context = {'author': author, 'stats': stats, 'page': page}
     if request.user.is_authenticated:
-        authors = User.objects.filter(following__user=request.user)
-        following = author in authors
-        return render(request, 'posts/profile.html', {'author': author,
-                                                      'page': page,
-                                                      'following': following})
-    return render(request, 'posts/profile.html', {'author': author,
-                                                  'page': page})
+        context['following'] = Follow.objects.filter(
+            user=request.user, author=author).exists()
+    return render(request, 'posts/profile.html', context)
 
 
+@condition(etag_func=post_etag)
 def post_view(request, username, post_id):
     author = get_object_or_404(User, username=username)
-    posts_by_id = get_object_or_404(Post, author=author, id=post_id)
+    posts_by_id = get_object_or_404(Post.feed, author=author, id=post_id)
     form = CommentForm()
     comments = posts_by_id.comments.all()
     return render(request, 'posts/post.html', {'author': author,
@@ -105,13 +180,24 @@ def server_error(request):
     return render(request, 'misc/500.html', status=500)
 
 
+def prometheus_metrics(request):
+    """Метрики процесса для Prometheus; доступны только с заголовком
+    ``Authorization: Bearer <METRICS_TOKEN>``."""
+    token = settings.METRICS_TOKEN
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if not token or not hmac.compare_digest(
+            header.encode(), ('Bearer %s' % token).encode()):
+        raise Http404
+    return HttpResponse(metrics.render(),
+                        content_type='text/plain; version=0.0.4; '
+                                     'charset=utf-8')
+
+
 @login_required
 def follow_index(request):
     user = request.user
-    posts = Post.objects.filter(author__following__user=user)
-    paginator = Paginator(posts, 10)
     page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    page = timeline.follow_page(user, page_number, request.GET.get('cursor'))
 
     return render(request, "follow.html", {'page': page})
 
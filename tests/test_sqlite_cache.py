@@ -0,0 +1,115 @@
+import os
+import stat
+import time
+from multiprocessing import get_context
+from unittest import mock
+
+import pytest
+from django.core.exceptions import ImproperlyConfigured
+
+from yatube.sqlite_cache import SQLiteCache
+
+
+def bump_in_child(location):
+    SQLiteCache(location, {}).incr('counter')
+
+
+@pytest.fixture
+def location(tmp_path):
+    return str(tmp_path / 'cache.sqlite3')
+
+
+@pytest.fixture
+def cache(location):
+    return SQLiteCache(location, {
+        'OPTIONS': {'MAX_ENTRIES': 10, 'MAX_SIZE': 10 * 1024}})
+
+
+class TestSQLiteCache:
+
+    def test_set_get_add_incr(self, cache):
+        cache.set('key', {'value': 1})
+        assert cache.get('key') == {'value': 1}
+        assert not cache.add('key', 'другое'), (
+            'add не должен перезаписывать существующий ключ')
+        assert cache.add('new', 1)
+        assert cache.incr('new', 5) == 6
+        assert cache.get_many(['key', 'new', 'missing']) == {
+            'key': {'value': 1}, 'new': 6}
+        with pytest.raises(ValueError):
+            cache.incr('missing')
+
+    def test_expired_entries_are_missing(self, cache):
+        cache.set('key', 'value', 1)
+        cache.set('forever', 'value', None)
+        time.sleep(1.1)
+        assert cache.get('key') is None, 'Истекшая запись не должна читаться'
+        assert cache.add('key', 'new'), 'Истекшая запись не должна мешать add'
+        assert cache.get('forever') == 'value'
+
+    def test_least_recently_used_entries_are_culled(self, cache):
+        for i in range(10):
+            cache.set('key%s' % i, i)
+        time.sleep(1.1)
+        cache.get('key0')
+        cache.set('key10', 10)
+        assert cache.get('key0') == 0, 'Недавно прочитанная запись вытеснена'
+        assert cache.get('key1') is None
+        assert cache.get('key10') == 10
+
+    def test_access_time_is_updated_in_batches(self, cache):
+        for i in range(3):
+            cache.set('key%s' % i, i)
+        time.sleep(1.1)
+        cache.get('key0')
+        cache.get('key1')
+        accessed = {key: value for key, value in cache._connection.execute(
+            'SELECT key, accessed FROM cache').fetchall()}
+        accessed = {key: accessed[cache.make_key(key)]
+                    for key in ('key0', 'key1', 'key2')}
+        assert accessed['key0'] > accessed['key2'], (
+            'Первое чтение после паузы должно записать время обращения')
+        assert accessed['key1'] < accessed['key0'], (
+            'Чтения между записями времени должны копиться в памяти')
+
+    def test_locked_database_does_not_block_reads(self, cache, location):
+        cache.set('key', 'value')
+        time.sleep(1.1)
+        writer = SQLiteCache(location, {})._connection
+        writer.execute('BEGIN IMMEDIATE')
+        try:
+            started = time.time()
+            assert cache.get('key') == 'value'
+            assert time.time() - started < 1, (
+                'Чтение не должно ждать блокировку на запись')
+        finally:
+            writer.execute('ROLLBACK')
+
+    def test_size_limit_is_enforced(self, cache):
+        for i in range(5):
+            cache.set('key%s' % i, b'x' * 4096)
+        size = cache._connection.execute(
+            'SELECT size FROM cache_stats').fetchone()[0]
+        assert size <= 10 * 1024
+        assert cache.get('key4') is not None
+
+    def test_cache_is_shared_between_processes(self, cache, location):
+        cache.set('counter', 1)
+        process = get_context('fork').Process(target=bump_in_child,
+                                              args=(location,))
+        process.start()
+        process.join()
+        assert cache.get('counter') == 2, (
+            'Изменения из другого процесса должны быть видны сразу')
+
+    def test_files_are_private(self, cache, location):
+        cache.set('key', 'value')
+        for path in (location, location + '-wal'):
+            assert stat.S_IMODE(os.stat(path).st_mode) == 0o600, (
+                'Файлы кеша не должны быть доступны другим пользователям')
+
+    def test_foreign_file_is_refused(self, location):
+        open(location, 'w').close()
+        with mock.patch('os.getuid', return_value=os.getuid() + 1):
+            with pytest.raises(ImproperlyConfigured):
+                SQLiteCache(location, {}).get('key')
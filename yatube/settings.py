@@ -40,6 +40,10 @@ ALLOWED_HOSTS = [
 
 ]
 
+# Токен, с которым Prometheus запрашивает /metrics в заголовке
+# Authorization: Bearer <токен>; без токена страница недоступна
+METRICS_TOKEN = os.environ.get('YATUBE_METRICS_TOKEN', '')
+
 
 # Application definition
 
@@ -58,7 +62,11 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    # Первой: время ответа включает все остальные прослойки
+    'posts.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # До сессий: ответ из кеша не трогает сессии и аутентификацию
+    'posts.middleware.AnonymousPageCacheMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -69,8 +77,73 @@ MIDDLEWARE = [
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+    },
+    # Копии страниц на случай ошибки базы (posts.fallback) хранятся
+    # отдельно, чтобы их не вытесняли записи основного кеша
+    'stale': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'stale',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
 }
+# Несколько процессов WSGI на одном сервере должны делить один кеш, иначе
+# сброс версий в одном процессе не виден другим: YATUBE_SHARED_CACHE=1.
+# Файлы кеша лежат рядом с базой, а не в общем для всех /tmp: записи
+# читаются через pickle
+if os.environ.get('YATUBE_SHARED_CACHE'):
+    CACHES['default'] = {
+        'BACKEND': 'yatube.sqlite_cache.SQLiteCache',
+        'LOCATION': os.environ.get(
+            'YATUBE_CACHE_PATH',
+            os.path.join(BASE_DIR, 'cache.sqlite3')),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'MAX_SIZE': 256 * 1024 * 1024,
+        },
+    }
+    CACHES['stale'] = {
+        'BACKEND': 'yatube.sqlite_cache.SQLiteCache',
+        'LOCATION': os.environ.get(
+            'YATUBE_STALE_CACHE_PATH',
+            os.path.join(BASE_DIR, 'stale-cache.sqlite3')),
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'MAX_SIZE': 64 * 1024 * 1024,
+        },
+    }
+# Главная страница сбрасывается сигналами при изменении постов, комментариев
+# и групп, поэтому время жизни ее кеша не влияет на свежесть ленты
+INDEX_CACHE_TIMEOUT = 60 * 5
+# Страницы ленты подписок сбрасываются при новых постах авторов, подписке
+# и отписке
+FOLLOW_CACHE_TIMEOUT = 60 * 5
+# Целые страницы для анонимных посетителей сбрасываются теми же сигналами
+PAGE_CACHE_TIMEOUT = 60 * 5
+# Сколько секунд прокси могут показывать такую страницу без проверки;
+# браузеры проверяют ее каждый раз
+PAGE_CACHE_MAX_AGE = 60
+# Устаревшая лента хранится еще столько секунд и отдается, пока один
+# процесс строит новую
+CACHE_STALE_TIMEOUT = 60 * 60
+# Сколько секунд процесс может строить запись под блокировкой
+CACHE_LOCK_TIMEOUT = 10
+# Запросы ленты, которые идут дольше этого числа секунд, прерываются, и
+# вместо страницы отдается ее последняя удачная копия (только SQLite)
+FEED_LATENCY_BUDGET = 2
+# Копия удачной страницы ленты обновляется не чаще раза в столько секунд
+STALE_COPY_INTERVAL = 60
+# Фоновое обновление страницы после ошибки: число попыток, пауза перед
+# второй попыткой (дальше удваивается), предельное время и число потоков.
+# Пока оно идет, копия отдается сразу
+STALE_REFRESH_ATTEMPTS = 3
+STALE_REFRESH_DELAY = 1
+STALE_REFRESH_TIMEOUT = 60
+STALE_REFRESH_WORKERS = 2
 
 ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
@@ -80,7 +153,8 @@ TEMPLATES_ABOUT = os.path.join(BASE_DIR, 'templates/about')
 TEMPLATES_MISC = os.path.join(BASE_DIR, 'templates/misc')
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Стандартный бэкенд с замером времени рендеринга для /metrics
+        'BACKEND': 'posts.metrics.DjangoTemplates',
         'DIRS': [TEMPLATES_DIR, TEMPLATES_POSTS, TEMPLATES_USERS,
                  TEMPLATES_ABOUT, TEMPLATES_MISC],
         'APP_DIRS': True,
@@ -157,3 +231,56 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 LOGIN_URL = "/auth/login/"
 LOGIN_REDIRECT_URL = "posts:index"
 # LOGOUT_REDIRECT_URL = "index"
+
+# Лента подписок
+
+# Посты авторов, у которых подписчиков больше этого числа, не копируются
+# в ленты подписчиков, а подмешиваются при чтении
+TIMELINE_FANOUT_LIMIT = 10000
+# Размер пачки при заполнении и очистке лент
+TIMELINE_BATCH_SIZE = 1000
+# Сколько последних постов копируется подписчикам автора, который перестал
+# быть знаменитостью
+TIMELINE_RESTORE_LIMIT = 100
+
+# Время жизни закешированной карточки поста. Изменения поста, автора или
+# группы меняют ключ карточки, поэтому время можно делать большим
+POST_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Число потоков, которые создают миниатюры загруженных картинок
+THUMBNAIL_WORKERS = 2
+
+# Записи миниатюр страницы подгружаются одним запросом и хранятся в LRU
+# внутри процесса
+THUMBNAIL_KVSTORE = 'posts.kvstore.PrefetchingKVStore'
+# Число записей миниатюр в LRU процесса
+THUMBNAIL_LRU_SIZE = 1000
+
+# Загрузки пишутся во временный файл, а не в память
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# Картинки постов уменьшаются до этого размера по большей стороне
+IMAGE_MAX_SIDE = 1920
+# Картинки с большим числом пикселей отклоняются до декодирования
+IMAGE_MAX_PIXELS = 50 * 1000 * 1000
+# Качество пересжатия JPEG и WebP
+IMAGE_QUALITY = 85
+
+# Картинка без ссылок из постов удаляется сразу, только если она не
+# менялась дольше этого числа секунд; иначе ее убирает сборщик мусора
+MEDIA_RELEASE_GRACE = 60 * 60
+# Сколько файлов collect_media проверяет одним запросом
+MEDIA_BATCH_SIZE = 1000
+
+# Больше этого числа записи в списках админки не считаются
+ESTIMATED_COUNT_LIMIT = 10000
+# Списки постов меньше этого числа считаются точно, а больше — по
+# денормализованным счетчикам
+EXACT_COUNT_LIMIT = 1000
+# Счетчик большой группы или профиля пересчитывается в фоне не чаще раза
+# в это число секунд
+STATS_REFRESH_INTERVAL = 60 * 10
+# Сколько профилей или групп recount_stats сверяет одним запросом
+STATS_BATCH_SIZE = 1000
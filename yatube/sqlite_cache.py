@@ -0,0 +1,283 @@
+"""Кеш в файле SQLite, общий для всех процессов WSGI на одном сервере.
+
+LocMemCache живет внутри процесса: у каждого воркера свой кеш, а сброс
+версии в одном воркере не виден остальным. Этот бэкенд хранит записи в
+базе SQLite в режиме WAL, поэтому читатели не блокируют писателя, и не
+требует отдельного сервиса.
+
+Записи читаются через pickle, поэтому файл создается с правами 0600, а
+чужой файл на его месте не открывается: иначе другой пользователь
+сервера мог бы подложить запись или прочитать закешированные страницы.
+
+Записи вытесняются по LRU, когда их число превышает ``MAX_ENTRIES`` или
+суммарный размер превышает ``MAX_SIZE`` байт. Счетчики числа и размера
+записей ведут триггеры, так что проверка лимитов не сканирует таблицу.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.exceptions import ImproperlyConfigured
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires REAL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed);
+CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires);
+CREATE TABLE IF NOT EXISTS cache_stats (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    entries INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO cache_stats VALUES (1, 0, 0);
+CREATE TRIGGER IF NOT EXISTS cache_insert AFTER INSERT ON cache BEGIN
+    UPDATE cache_stats SET entries = entries + 1, size = size + NEW.size;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_delete AFTER DELETE ON cache BEGIN
+    UPDATE cache_stats SET entries = entries - 1, size = size - OLD.size;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_update AFTER UPDATE OF size ON cache BEGIN
+    UPDATE cache_stats SET size = size - OLD.size + NEW.size;
+END;
+"""
+
+# Время последнего обращения записывается не чаще раза в секунду на поток,
+# одним UPDATE для всех прочитанных с прошлой записи ключей, чтобы чтение
+# не превращалось в поток записей
+ACCESS_RESOLUTION = 1
+# Столько ключей копится до записи независимо от времени; больше в памяти
+# не держится, если база долго занята
+ACCESS_BATCH = 500
+# Сколько секунд запись ждет блокировку базы
+BUSY_TIMEOUT = 30
+
+
+class SQLiteCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._location = location
+        options = params.get('OPTIONS', {})
+        self._max_size = int(options.get('MAX_SIZE', 64 * 1024 * 1024))
+        self._local = threading.local()
+
+    @property
+    def _connection(self):
+        # Соединение своё у каждого потока и у каждого процесса: после
+        # fork соединение родителя использовать нельзя
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            self._create_file()
+            connection = sqlite3.connect(self._location, timeout=BUSY_TIMEOUT,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _create_file(self):
+        """Создать файл кеша с правами 0600 и проверить, что он наш.
+
+        Файлы журнала WAL SQLite создает с правами основного файла.
+        """
+        fd = os.open(self._location, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            owner = os.fstat(fd).st_uid
+        finally:
+            os.close(fd)
+        if owner != os.getuid():
+            raise ImproperlyConfigured(
+                'Файл кеша %s принадлежит другому пользователю'
+                % self._location)
+
+    def _transaction(self):
+        return Transaction(self._connection)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        now = time.time()
+        with self._transaction() as db:
+            db.execute('DELETE FROM cache WHERE key = ? AND expires <= ?',
+                       (key, now))
+            added = db.execute(
+                'INSERT OR IGNORE INTO cache VALUES (?, ?, ?, ?, ?)',
+                self._row(key, value, timeout, now)).rowcount
+            if added:
+                self._cull(db, now)
+        return bool(added)
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self._get_many([key]).get(key, default)
+
+    def get_many(self, keys, version=None):
+        keys = {self.make_key(key, version=version): key for key in keys}
+        for key in keys:
+            self.validate_key(key)
+        found = self._get_many(list(keys))
+        return {keys[key]: value for key, value in found.items()}
+
+    def _get_many(self, keys):
+        if not keys:
+            return {}
+        now = time.time()
+        db = self._connection
+        placeholders = ', '.join('?' * len(keys))
+        rows = db.execute(
+            'SELECT key, value, expires, accessed FROM cache '
+            'WHERE key IN (%s)' % placeholders, keys).fetchall()
+        found = {}
+        pending = self._pending_access()
+        for key, value, expires, accessed in rows:
+            if expires is not None and expires <= now:
+                continue
+            found[key] = pickle.loads(value)
+            if accessed < now - ACCESS_RESOLUTION:
+                pending.add(key)
+        if pending and (len(pending) >= ACCESS_BATCH
+                        or now - self._local.flushed >= ACCESS_RESOLUTION):
+            self._flush_access(pending, now)
+        return found
+
+    def _pending_access(self):
+        if getattr(self._local, 'accessed', None) is None:
+            self._local.accessed = set()
+            self._local.flushed = 0
+        return self._local.accessed
+
+    def _flush_access(self, keys, now):
+        """Записать время обращения к ``keys``, если база не занята.
+
+        Чтение не ждет чужую запись: при занятой блокировке время
+        обращения остается в памяти до следующей попытки (но не больше
+        ``ACCESS_BATCH`` ключей), а LRU всего лишь чуть менее точен.
+        """
+        db = self._connection
+        self._local.flushed = now
+        db.execute('PRAGMA busy_timeout = 0')
+        try:
+            with Transaction(db):
+                db.execute('UPDATE cache SET accessed = ? WHERE key IN (%s)'
+                           % ', '.join('?' * len(keys)), [now] + list(keys))
+        except sqlite3.OperationalError:
+            if len(keys) < ACCESS_BATCH:
+                return
+        finally:
+            db.execute('PRAGMA busy_timeout = %d' % (BUSY_TIMEOUT * 1000))
+        keys.clear()
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        now = time.time()
+        rows = []
+        for key, value in data.items():
+            key = self.make_key(key, version=version)
+            self.validate_key(key)
+            rows.append(self._row(key, value, timeout, now))
+        with self._transaction() as db:
+            db.executemany(
+                'INSERT INTO cache VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET value = excluded.value, '
+                'size = excluded.size, expires = excluded.expires, '
+                'accessed = excluded.accessed', rows)
+            self._cull(db, now)
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return bool(self._connection.execute(
+            'UPDATE cache SET expires = ? WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), key, time.time())).rowcount)
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._transaction() as db:
+            row = db.execute(
+                'SELECT value FROM cache WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (key, time.time())).fetchone()
+            if row is None:
+                raise ValueError("Key '%s' not found" % key)
+            value = pickle.loads(row[0]) + delta
+            pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            db.execute('UPDATE cache SET value = ?, size = ? WHERE key = ?',
+                       (pickled, len(pickled), key))
+        return value
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._connection.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self._connection.execute(
+            'SELECT 1 FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (key, time.time())).fetchone() is not None
+
+    def clear(self):
+        self._connection.execute('DELETE FROM cache')
+
+    def close(self, **kwargs):
+        # Соединения долгоживущие и принадлежат потоку: закрывать их после
+        # каждого запроса незачем
+        pass
+
+    def _row(self, key, value, timeout, now):
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        return (key, pickled, len(pickled), self.get_backend_timeout(timeout),
+                now)
+
+    def _cull(self, db, now):
+        entries, size = db.execute(
+            'SELECT entries, size FROM cache_stats').fetchone()
+        if entries <= self._max_entries and size <= self._max_size:
+            return
+        db.execute('DELETE FROM cache WHERE expires <= ?', (now,))
+        entries, size = db.execute(
+            'SELECT entries, size FROM cache_stats').fetchone()
+        # Несколько больших записей могут держать размер выше лимита и
+        # после удаления доли записей, поэтому вытесняем до результата
+        while entries > self._max_entries or size > self._max_size:
+            db.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                'ORDER BY accessed LIMIT ?)',
+                (max(entries // self._cull_frequency, 1),))
+            entries, size = db.execute(
+                'SELECT entries, size FROM cache_stats').fetchone()
+
+
+class Transaction:
+    """Транзакция с немедленной блокировкой на запись: чтение и изменение
+    значения в ``incr`` и ``add`` не перемешиваются с другими процессами."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.connection.execute('COMMIT')
+        else:
+            self.connection.execute('ROLLBACK')